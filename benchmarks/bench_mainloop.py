@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput of Subscriber.mainloop against the old
+byte-at-a-time reader on a synthetic burst of servo telemetry.
+
+No MSG server is needed, the stream is fed straight into an
+asyncio.StreamReader.
+
+    python benchmarks/bench_mainloop.py [nlines]
+"""
+import asyncio
+import inspect
+import sys
+import time
+
+from saomsg.client import PostedValues, Subscriber, Subscription, SET, ACK, NAK, msg_factory
+
+
+def telemetry(nlines):
+    """A WAVESERV like burst of subscribed servo values."""
+    lines = []
+    for i in range(nlines):
+        axis = i % 8 + 1
+        lines.append(f"0 set p1{axis}0 {i * 0.125:.3f} {i % 7} ok\n")
+    return "".join(lines).encode()
+
+
+def ignore(*value):
+    pass
+
+
+def make_subscriber(data):
+    sub = Subscriber()
+    sub.server_info = dict(name="BENCH", published=[], registered=[], subscribed=PostedValues())
+    # Posts are only taken for subscribed params. Both loops
+    # hand each value to a callback that does nothing with it.
+    sub.subscriptions = {f"p1{axis}0": Subscription(f"p1{axis}0", ignore) for axis in range(1, 9)}
+    sub.running = True
+    sub.reader = asyncio.StreamReader()
+    sub.reader.feed_data(data)
+    sub.reader.feed_eof()
+    return sub
+
+
+async def legacy_mainloop(self):
+    """The reader Subscriber.mainloop used before the chunked reader."""
+    self.msg_debug_queue = asyncio.Queue()
+    rawdata = b""
+
+    while self.running:
+        byte = await asyncio.wait_for(self.reader.read(1), 5.0)
+        if not byte:
+            break
+        rawdata += byte
+        data = rawdata.decode()
+
+        if rawdata.endswith(b"\n"):
+            rawdata = b""
+        else:
+            continue
+
+        self.last_data = data
+        acknak = msg_factory(data)
+        self.msg_debug_queue.put_nowait((data, acknak))
+
+        if type(acknak) is SET:
+            self.server_info["subscribed"][acknak.param] = " ".join(acknak.value)
+            if acknak.param in self.subscriptions:
+                cb = self.subscriptions[acknak.param].callback
+                if inspect.iscoroutinefunction(cb):
+                    self.tasks.add(asyncio.create_task(cb(*acknak.value)))
+                else:
+                    asyncio.get_running_loop().call_soon(cb, acknak.value)
+
+        elif acknak.msgid in self.outstanding_replies:
+            aq = self.outstanding_replies.pop(acknak.msgid)
+            if type(acknak) is ACK:
+                await aq.put(acknak.args)
+            elif type(acknak) is NAK:
+                await aq.put(RuntimeError(acknak.info))
+
+
+async def chunked_mainloop(self):
+    self._start_reader()
+    await self.mainloop()
+
+
+async def bench(label, loop_fxn, data, nlines):
+    sub = make_subscriber(data)
+    start = time.perf_counter()
+    await loop_fxn(sub)
+    elapsed = time.perf_counter() - start
+    assert len(sub.server_info["subscribed"]) == 8
+    print(f"{label:>12s}: {nlines / elapsed:12,.0f} lines/s ({elapsed:.3f} s)")
+    return elapsed
+
+
+async def main(nlines):
+    data = telemetry(nlines)
+    print(f"{nlines} lines, {len(data)} bytes")
+    before = await bench("byte-by-byte", legacy_mainloop, data, nlines)
+    after = await bench("chunked", chunked_mainloop, data, nlines)
+    print(f"{'speedup':>12s}: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Compare the memory footprint and allocation rate of the
+slotted, lazily decoded message classes against the old
+dict backed dataclasses that decoded every line up front.
+
+A recorded stream (one MSG line per line, e.g. captured with
+nc from a live server) can be given on the command line,
+otherwise a synthetic WAVESERV like telemetry burst is used.
+
+    python benchmarks/bench_messages.py [recorded.txt]
+"""
+from dataclasses import dataclass
+import sys
+import time
+import tracemalloc
+import typing
+
+from saomsg.client import parse_msg
+
+from bench_mainloop import telemetry
+
+
+@dataclass
+class OldMSG:
+    msgid: typing.Union[int, None]
+
+
+@dataclass
+class OldSET(OldMSG):
+    param: str
+    value: typing.Any
+
+
+@dataclass
+class OldACK(OldMSG):
+    args: tuple
+
+
+@dataclass
+class OldNAK(OldMSG):
+    info: str
+
+
+def old_factory(data):
+    """msg_factory as it was before the bytes parser."""
+    vals = data.decode().split()
+
+    if vals[0].isnumeric():
+        msgid = int(vals[0])
+        Type = vals[1]
+        argindex = 2
+    else:
+        msgid = None
+        Type = vals[0]
+        argindex = 1
+
+    if Type == "set":
+        msg = OldSET(msgid, vals[argindex], vals[(argindex + 1):])
+    elif Type == "ack":
+        msg = OldACK(msgid, vals[argindex:])
+    elif Type == "nak":
+        msg = OldNAK(msgid, " ".join(vals[argindex:]))
+    else:
+        msg = OldMSG(msgid)
+        msg.info = vals[argindex:]
+
+    return msg
+
+
+def measure(label, factory, lines):
+    start = time.perf_counter()
+    msgs = [factory(line) for line in lines]
+    elapsed = time.perf_counter() - start
+    del msgs
+
+    tracemalloc.start()
+    msgs = [factory(line) for line in lines]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n = len(msgs)
+    print(
+        f"{label:>8s}: {current / n:7.1f} bytes/msg retained, "
+        f"{peak / n:7.1f} bytes/msg peak, {n / elapsed:12,.0f} msgs/s"
+    )
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as fp:
+            lines = [line for line in fp.read().split(b"\n") if line.strip()]
+    else:
+        lines = telemetry(200000).split(b"\n")[:-1]
+
+    print(f"{len(lines)} lines")
+    measure("old", old_factory, lines)
+    measure("slotted", parse_msg, lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Measure how long a reconnecting Subscriber takes to get its
+subscriptions back after the MSG server is killed and restarted.
+
+The server is a minimal stand-in run as a subprocess of this
+script, so it can be killed outright and started again.
+
+    python benchmarks/bench_reconnect.py [nparams] [rounds]
+"""
+import asyncio
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+from saomsg.client import Subscriber
+
+PORT = 6869
+# The checkout this script is in, for the server subprocess to import saomsg from.
+ROOT = Path(__file__).resolve().parents[1]
+
+
+async def serve(port, nparams):
+    """A MSG server publishing p0 .. p<nparams-1> that answers lst, sub and get."""
+    names = [f"p{i}" for i in range(nparams)]
+    listing = "".join(f"published\t{name}\tstand-in\n" for name in names)
+
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            msgid, verb, *args = line.decode().split()
+            if verb == "lst":
+                writer.write(f"{msgid} ack\nserver\tSTANDIN\tstand-in\n{listing}----LIST----\n".encode())
+            elif verb == "sub":
+                writer.write(f"{msgid} ack 0\n0 set {args[0]} 0\n".encode())
+            elif verb == "get":
+                writer.write(f"{msgid} ack 0\n".encode())
+            else:
+                writer.write(f"{msgid} nak unknown {verb}\n".encode())
+        writer.close()
+
+    server = await asyncio.start_server(handle, "localhost", port)
+    async with server:
+        await server.serve_forever()
+
+
+async def start_server(nparams):
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--serve", str(nparams), env=dict(os.environ, PYTHONPATH=str(ROOT))
+    )
+    # Wait until it accepts connections.
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection("localhost", PORT)
+        except OSError:
+            if proc.returncode is not None:
+                raise RuntimeError(f"Stand-in server exited with status {proc.returncode}")
+            await asyncio.sleep(0.01)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return proc
+
+
+async def main(nparams, rounds):
+    proc = await start_server(nparams)
+    c = Subscriber("localhost", PORT, reconnect=True, retry=("get",))
+    await c.open()
+
+    acks = 0
+    replayed = asyncio.Event()
+
+    def count(value):
+        nonlocal acks
+        acks += 1
+        if acks % nparams == 0:
+            replayed.set()
+
+    await asyncio.gather(*(c.subscribe(name, count) for name in c.server_info["published"]))
+    print(f"{nparams} subscriptions, reconnect backoff {c.RECONNECT_MIN}-{c.RECONNECT_MAX} s")
+
+    for n in range(rounds):
+        replayed.clear()
+        killed = time.perf_counter()
+        proc.send_signal(signal.SIGKILL)
+        while c.running:
+            await asyncio.sleep(0.001)
+        detected = time.perf_counter()
+        await proc.wait()
+
+        proc = await start_server(nparams)
+        restarted = time.perf_counter()
+        await asyncio.wait_for(replayed.wait(), 30)
+        done = time.perf_counter()
+        assert await c.get("p0") == ["0"]
+        print(
+            f"round {n}: loss noticed in {1000 * (detected - killed):6.1f} ms,"
+            f" subscriptions back {1000 * (done - restarted):6.1f} ms after restart"
+            f" ({1000 * (done - killed):6.1f} ms outage)"
+        )
+
+    await c.stop()
+    await c.close()
+    proc.kill()
+    await proc.wait()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        asyncio.run(serve(PORT, int(sys.argv[2])))
+    else:
+        nparams = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+        rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        asyncio.run(main(nparams, rounds))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Measure how fast MSGServer fans sets of one param out to many
+subscribers. Each subscriber is a bare connection that subscribes
+with update 0 and counts the posts it reads.
+
+    python benchmarks/bench_server.py [subscribers] [sets]
+"""
+import asyncio
+import sys
+import time
+
+from saomsg.server import MSGServer
+
+
+async def subscriber(port, nsets, ready):
+    reader, writer = await asyncio.open_connection("localhost", port)
+    writer.write(b"1 sub p0 0\n")
+    await reader.readline()
+    await reader.readline()
+    ready.release()
+    for _ in range(nsets):
+        await reader.readline()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def main(nsubs, nsets):
+    server = MSGServer("BENCH", host="localhost", port=0)
+    server.publish("p0", 0)
+    await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+
+    ready = asyncio.Semaphore(0)
+    subs = [asyncio.create_task(subscriber(port, nsets, ready)) for _ in range(nsubs)]
+    for _ in range(nsubs):
+        await ready.acquire()
+
+    start = time.perf_counter()
+    for n in range(1, nsets + 1):
+        server.set("p0", n)
+        # Let the posts go out as a real server's event loop would.
+        await asyncio.sleep(0)
+    await asyncio.gather(*subs)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{nsubs} subscribers, {nsets} sets: {elapsed:.2f} s,"
+        f" {nsubs * nsets / elapsed:,.0f} posts/s, {1e6 * elapsed / nsets:.0f} us per set"
+    )
+    await server.close()
+
+
+if __name__ == "__main__":
+    nsubs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nsets = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    asyncio.run(main(nsubs, nsets))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Compare request latency and throughput of a Subscriber over TCP
+loopback, with and without TCP_NODELAY, and over a Unix domain
+socket, using the same request mix on each: sequential gets, each
+waited on before the next, then bursts of pipelined gets.
+
+The server is a minimal stand-in running in this process that
+listens on TCP and a Unix socket at once.
+
+    python benchmarks/bench_transport.py [requests] [burst]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from saomsg import transport
+from saomsg.client import Subscriber
+
+PORT = 6869
+
+
+async def handle(reader, writer):
+    """Answer lst with one published param and get with its value."""
+    while line := await reader.readline():
+        msgid, verb, *args = line.decode().split()
+        if verb == "lst":
+            writer.write(f"{msgid} ack\nserver\tSTANDIN\tstand-in\npublished\tp0\tstand-in\n----LIST----\n".encode())
+        elif verb == "get":
+            writer.write(f"{msgid} ack 0\n".encode())
+        else:
+            writer.write(f"{msgid} nak unknown {verb}\n".encode())
+    writer.close()
+
+
+async def run(label, host, options, nrequests, burst):
+    c = Subscriber(host, PORT, socket_options=options, timeouts=False)
+    await c.open()
+
+    latencies = []
+    for _ in range(nrequests):
+        start = time.perf_counter()
+        await c.get("p0")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(nrequests // burst):
+        await asyncio.gather(*(c.get("p0") for _ in range(burst)))
+    elapsed = time.perf_counter() - start
+
+    await c.close()
+    latencies.sort()
+    print(
+        f"{label:18s} median {1e6 * statistics.median(latencies):7.1f} us"
+        f"  p99 {1e6 * latencies[int(0.99 * len(latencies))]:7.1f} us"
+        f"  pipelined {(nrequests // burst) * burst / elapsed:9.0f} req/s"
+    )
+
+
+async def main(nrequests, burst):
+    with tempfile.TemporaryDirectory() as tmp:
+        unix = f"{transport.UNIX_PREFIX}{os.path.join(tmp, 'msg.sock')}"
+        servers = [
+            await asyncio.start_server(handle, "localhost", PORT),
+            await transport.start_server(handle, unix, None),
+        ]
+        print(f"{nrequests} sequential gets, then pipelined in bursts of {burst}")
+        await run("tcp nodelay", "localhost", dict(nodelay=True), nrequests, burst)
+        await run("tcp nagle", "localhost", dict(nodelay=False), nrequests, burst)
+        await run("unix", unix, {}, nrequests, burst)
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == "__main__":
+    nrequests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    burst = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(nrequests, burst))
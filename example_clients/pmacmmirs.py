@@ -9,25 +9,28 @@ import time
 
 from collections import OrderedDict
 
-from saomsg.client import Subscriber
+from saomsg.client import Subscriber, connect_all
 
 
 async def main(wheel, goto):
 
-    pmac = Subscriber(host="fields", port=10100)
-    pows = Subscriber(host="fields", port=10101)
-    await pmac.open()
-    await pows.open()
+    reports = await connect_all([("fields", 10100), ("fields", 10101)], deadline=10.0)
+    for report in reports.values():
+        if report.error is not None:
+            raise report.error
+    pmac = reports[("fields", 10100)].client
+    pows = reports[("fields", 10101)].client
 
     tsk1 = asyncio.create_task(pmac.mainloop())
     tsk2 = asyncio.create_task(pows.mainloop())
     await asyncio.sleep(1.0)
 
-    positions = {}
-    for number in range(1, 7):
-        name = await pmac.get(f"{wheel}Names{number}")
-        pos = await pmac.get(f"{wheel}Pos{number}")
-        positions[number] = (name, pos)
+    # Requests are pipelined on the one connection so
+    # gathering them costs a single round trip.
+    numbers = range(1, 7)
+    names = await asyncio.gather(*(pmac.get(f"{wheel}Names{n}") for n in numbers))
+    poss = await asyncio.gather(*(pmac.get(f"{wheel}Pos{n}") for n in numbers))
+    positions = dict(zip(numbers, zip(names, poss)))
 
     msg_vars = (
         "Pos",
@@ -98,10 +101,15 @@ async def goto(wheel, Filter):
 
         row = []
         print(wheel)
-        await pmac.run(wheel, Filter)
-        for param_name in gettables:
-            print(f"{wheel}{param_name}")
-            value = await pmac.get(f"{wheel}{param_name}")
+        try:
+            await pmac.run(wheel, Filter)
+            values = await asyncio.gather(
+                *(pmac.get(f"{wheel}{param_name}") for param_name in gettables)
+            )
+        except asyncio.TimeoutError:
+            print(f"No reply from the pmac moving {wheel} to {Filter}")
+            break
+        for param_name, value in zip(gettables, values):
             print(f"{param_name}\t {value[0]}")
             row.append(value[0])
         row += [wheel, Filter]
@@ -0,0 +1,208 @@
+import bisect
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+catlogger = logging.getLogger("msg-client-logger")
+
+
+@dataclass(frozen=True, slots=True)
+class Entry:
+    """One line of a lst listing. kind is published or registered."""
+
+    name: str
+    kind: str
+    comment: str = ""
+
+
+@dataclass(slots=True)
+class CatalogDiff:
+    """
+    The changes that turn one catalog into another: entries that
+    are new, gone or have a new comment, and the new (server,
+    server_comment) if that changed. False if there are none.
+    """
+
+    added: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    server: tuple = None
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.server)
+
+
+class Catalog:
+    """
+    What a MSG server offers, indexed from its lst listing.
+
+    published and registered are read-only mappings of name to
+    Entry, in listing order, so membership tests are hash lookups
+    and iterating gives the names as the old lists did. Sorted
+    copies of the names back prefix().
+
+    apply() updates a catalog in place, so the views stay current.
+    """
+
+    KINDS = ("published", "registered")
+
+    def __init__(self, entries=(), server=None, server_comment=""):
+        self.server = server
+        self.server_comment = server_comment
+        self._entries = {kind: {} for kind in self.KINDS}
+        for entry in entries:
+            self._entries[entry.kind][entry.name] = entry
+        self.published = MappingProxyType(self._entries["published"])
+        self.registered = MappingProxyType(self._entries["registered"])
+        self._sorted = {kind: sorted(names) for kind, names in self._entries.items()}
+
+    @classmethod
+    def from_listing(cls, lines):
+        """
+        Build a catalog from the lines of a lst listing, e.g.
+
+            server<TAB>TESTSRV<TAB>Test server
+            published<TAB>foo<TAB>The foo value
+
+        Lines without tabs are split on whitespace instead.
+        Anything that is not a server, published or registered
+        record is skipped.
+        """
+        entries = []
+        server = None
+        server_comment = ""
+        for line in lines:
+            if "\t" in line:
+                vals = line.rstrip("\n").split("\t", 2)
+            else:
+                vals = line.split(None, 2)
+            if len(vals) < 2:
+                continue
+            kind, name = vals[0], vals[1].strip()
+            comment = vals[2].strip() if len(vals) > 2 else ""
+            if kind == "server":
+                server, server_comment = name, comment
+            elif kind in cls.KINDS:
+                entries.append(Entry(name, kind, comment))
+        return cls(entries, server, server_comment)
+
+    def __contains__(self, name):
+        return name in self.published or name in self.registered
+
+    def __len__(self):
+        return len(self.published) + len(self.registered)
+
+    def __iter__(self):
+        yield from self.published.values()
+        yield from self.registered.values()
+
+    def __eq__(self, other):
+        if not isinstance(other, Catalog):
+            return NotImplemented
+        return (self.server, self.server_comment, dict(self.published), dict(self.registered)) == (
+            other.server,
+            other.server_comment,
+            dict(other.published),
+            dict(other.registered),
+        )
+
+    def diff(self, other):
+        """Return the CatalogDiff that turns this catalog into other."""
+        diff = CatalogDiff()
+        for kind in self.KINDS:
+            mine, theirs = self._entries[kind], other._entries[kind]
+            for name, entry in theirs.items():
+                old = mine.get(name)
+                if old is None:
+                    diff.added.append(entry)
+                elif old != entry:
+                    diff.changed.append(entry)
+            diff.removed.extend(entry for name, entry in mine.items() if name not in theirs)
+
+        if (self.server, self.server_comment) != (other.server, other.server_comment):
+            diff.server = (other.server, other.server_comment)
+        return diff
+
+    def apply(self, diff):
+        """Apply the changes in diff to this catalog."""
+        for entry in diff.removed:
+            del self._entries[entry.kind][entry.name]
+            names = self._sorted[entry.kind]
+            del names[bisect.bisect_left(names, entry.name)]
+        for entry in diff.changed:
+            self._entries[entry.kind][entry.name] = entry
+        for entry in diff.added:
+            self._entries[entry.kind][entry.name] = entry
+            bisect.insort(self._sorted[entry.kind], entry.name)
+        if diff.server is not None:
+            self.server, self.server_comment = diff.server
+
+    def to_dict(self):
+        """A JSON friendly form of the catalog, see from_dict."""
+        return dict(
+            server=self.server,
+            server_comment=self.server_comment,
+            entries=[[entry.name, entry.kind, entry.comment] for entry in self],
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls((Entry(*entry) for entry in data["entries"]), data["server"], data["server_comment"])
+
+    def comment(self, name):
+        """Return the comment for name, published first, or None."""
+        entry = self.published.get(name) or self.registered.get(name)
+        return None if entry is None else entry.comment
+
+    def prefix(self, prefix, kind="published"):
+        """Return the sorted names of kind that start with prefix."""
+        names = self._sorted[kind]
+        start = bisect.bisect_left(names, prefix)
+        end = start
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
+
+class CatalogCache:
+    """
+    Catalogs of MSG servers saved in the JSON file path, keyed by
+    "host:port". The server name is stored with each catalog so a
+    different server turning up on the same port is noticed when
+    the catalog is revalidated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as fd:
+                return json.load(fd)
+        except (OSError, ValueError) as error:
+            catlogger.warning(f"Ignoring catalog cache {self.path}: {error}")
+            return {}
+
+    def load(self, host, port):
+        """Return the cached Catalog for host:port or None."""
+        data = self._read().get(f"{host}:{port}")
+        if data is None:
+            return None
+        try:
+            return Catalog.from_dict(data)
+        except (KeyError, TypeError) as error:
+            catlogger.warning(f"Ignoring cached catalog for {host}:{port}: {error}")
+            return None
+
+    def store(self, host, port, catalog):
+        """Save catalog as the one for host:port."""
+        cache = self._read()
+        cache[f"{host}:{port}"] = catalog.to_dict()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as fd:
+            json.dump(cache, fd)
+        os.replace(tmp, self.path)
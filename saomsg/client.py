@@ -1,8 +1,18 @@
 import asyncio
+import collections
+import concurrent.futures
+import functools
 import inspect
-from dataclasses import dataclass
+import random
+import time
+from dataclasses import dataclass, field
 import typing
 import logging
+import warnings
+
+from .catalog import Catalog, CatalogCache
+from .rtt import AdaptiveTimeouts, RTTEstimator
+from . import transport
 
 clogger = logging.getLogger("msg-client-logger")
 clogger.setLevel(logging.DEBUG)
@@ -14,70 +24,328 @@ clogger.addHandler(logging.FileHandler(filename="client.log", mode="w"))
 # clarity.
 
 
-@dataclass
+@dataclass(slots=True)
 class MSG:
     msgid: typing.Union[int, None]
 
 
-@dataclass
+# The payload of SET, ACK, NAK and CMD is kept as the raw bytes
+# it arrived in and is only decoded when someone looks at it.
+# The decoded value is cached in a slot of its own.
+
+
+@dataclass(slots=True)
 class SET(MSG):
+    __match_args__ = ("msgid", "param", "value")
+
     param: str
-    value: typing.Any
+    raw: bytes = field(repr=False)
+    _text: typing.Union[str, None] = field(default=None, init=False, repr=False, compare=False)
+    _value: typing.Union[list, None] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def text(self):
+        """The value as a single string."""
+        if self._text is None:
+            self._text = self.raw.decode().strip()
+        return self._text
+
+    @property
+    def value(self):
+        """The value split on whitespace."""
+        if self._value is None:
+            self._value = self.text.split()
+        return self._value
+
+
+@dataclass(slots=True)
+class ACK(MSG):
+    __match_args__ = ("msgid", "args")
 
+    raw: bytes = field(repr=False)
+    _args: typing.Union[list, None] = field(default=None, init=False, repr=False, compare=False)
 
-@dataclass
-class ACK(MSG):
-    args: tuple
+    @property
+    def args(self):
+        if self._args is None:
+            self._args = self.raw.decode().split()
+        return self._args
 
 
-@dataclass
+@dataclass(slots=True)
 class NAK(MSG):
-    info: str
+    __match_args__ = ("msgid", "info")
+
+    raw: bytes = field(repr=False)
+
+    @property
+    def info(self):
+        return " ".join(self.raw.decode().split())
 
 
-def msg_factory(data: str):
+@dataclass(slots=True)
+class CMD(MSG):
     """
-    Best guess as to what type of
-    msg response we are receiving.
+    Anything that is not a set, ack or nak, e.g. a
+    request sent to a server or a command reply.
     """
-    vals = data.split()
 
-    if vals[0].isnumeric():
-        msgid = int(vals[0])
-        Type = vals[1]
-        argindex = 2
+    __match_args__ = ("msgid", "cmd", "args")
 
-    else:
+    cmd: str
+    raw: bytes = field(repr=False)
+
+    @property
+    def args(self):
+        return self.raw.decode().split()
+
+
+class PostedValues(collections.UserDict):
+    """
+    The last value posted to each subscribed param, as
+    server_info["subscribed"] holds them. A post is kept as the
+    SET it arrived in and only decoded to a string when it is
+    looked up.
+    """
+
+    def __getitem__(self, param):
+        value = self.data[param]
+        if type(value) is SET:
+            value = self.data[param] = value.text
+        return value
+
+
+@dataclass(slots=True, eq=False)
+class Subscription:
+    """
+    Book keeping for one subscribed variable. update is the
+    update argument sent with the sub request, None if the
+    server default was used. Subscriptions are compared and
+    hashed by identity.
+    """
+
+    param: str
+    callback: typing.Union[typing.Callable, None] = None
+    update: typing.Union[int, float, None] = None
+    # With conflate set at most one callback is in flight at a
+    # time (see Subscriber.MAX_TASKS_PER_PARAM otherwise). Values
+    # arriving meanwhile replace pending, the ones replaced
+    # before they were delivered are counted in dropped. Without
+    # it they wait their turn in backlog, up to max_pending.
+    conflate: bool = False
+    dropped: int = 0
+    inflight: int = field(default=0, repr=False)
+    pending: typing.Union[list, None] = field(default=None, repr=False)
+    backlog: collections.deque = field(default_factory=collections.deque, repr=False)
+    max_pending: int = field(default=100, repr=False)
+    # Callback statistics, see Subscriber.callback_stats.
+    calls: int = field(default=0, repr=False)
+    errors: int = field(default=0, repr=False)
+    busy_time: float = field(default=0.0, repr=False)
+    max_time: float = field(default=0.0, repr=False)
+    last_error: typing.Union[BaseException, None] = field(default=None, repr=False)
+    is_coroutine: bool = field(default=False, repr=False)
+    # For callbacks run in an executor: the executor, the queue
+    # of values waiting for it, the task feeding them to it and
+    # where to send the results.
+    executor: typing.Union[concurrent.futures.Executor, None] = field(default=None, repr=False)
+    queue: typing.Union[asyncio.Queue, None] = field(default=None, repr=False)
+    worker: typing.Union[asyncio.Task, None] = field(default=None, repr=False)
+    on_result: typing.Union[typing.Callable, None] = field(default=None, repr=False)
+    # The future resolved by the server's reply to the sub
+    # request, and the value the ack carried until the post
+    # repeating it has been seen.
+    ready: typing.Union[asyncio.Future, None] = field(default=None, repr=False)
+    echo: typing.Union[list, None] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        self.is_coroutine = inspect.iscoroutinefunction(self.callback)
+
+
+def _retrieve(fut):
+    """Done callback for futures nobody might wait on."""
+    if not fut.cancelled():
+        fut.exception()
+
+
+def parse_msg(line: bytes):
+    """
+    Parse a single MSG line without decoding it. Only the
+    msgid, the verb and (for a set) the param name are split
+    off, the rest of the line is left as bytes for the message
+    to decode on demand. Returns None for a blank line.
+    """
+    head = line.split(None, 2)
+    nhead = len(head)
+    if nhead and head[0].isdigit():
+        msgid = int(head[0])
+        verb = head[1] if nhead > 1 else b""
+        rest = head[2] if nhead > 2 else b""
+    elif nhead:
         msgid = None
-        Type = vals[0]
-        argindex = 1
+        verb, _, rest = line.strip().partition(b" ")
+    else:
+        return None
 
-    if Type == "set":
-        msg = SET(msgid, vals[argindex], vals[(argindex + 1):])
+    if verb == b"set":
+        param, _, value = rest.partition(b" ")
+        if not value:
+            param = param.strip()
+        msg = SET(msgid, param.decode(), value)
 
-    elif Type == "ack":
-        msg = ACK(msgid, vals[argindex:])
+    elif verb == b"ack":
+        msg = ACK(msgid, rest)
 
-    elif Type == "nak":
-        msg = NAK(msgid, " ".join(vals[argindex:]))
+    elif verb == b"nak":
+        msg = NAK(msgid, rest)
 
     else:
-        msg = MSG(msgid)
-        msg.info = vals[argindex:]
+        msg = CMD(msgid, verb.decode(), rest)
 
     return msg
 
 
+def msg_factory(data: typing.Union[str, bytes]):
+    """
+    Best guess as to what type of
+    msg response we are receiving.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+
+    return parse_msg(data)
+
+
 class MSGClient(object):
     """
     This class implements a very basic interface to the SAO MSG protocol.
+
+    Every request is sent with its own msgid and a background
+    reader task matches the ack or nak that comes back to the
+    request by msgid. Any number of requests can therefore be
+    outstanding on the one connection, e.g.
+
+        values = await asyncio.gather(*(c.get(p) for p in params))
+
+    pays for a single round trip.
     """
 
-    def __init__(self, host="localhost", port=6868):
+    MAXID = 100000
+
+    # Maximum number of bytes pulled off the socket per read.
+    READ_CHUNK = 65536
+
+    # Only keep this many (line, msg) pairs around for debugging.
+    DEBUG_QUEUE_SIZE = 1000
+
+    # Default number of bytes we let pile up in the transport
+    # before holding back further writes.
+    WRITE_HIGH_WATER = 65536
+
+    # Seconds get, run and lst wait for a reply by default.
+    REQUEST_TIMEOUT = 60.0
+
+    # With reconnect set, the first attempt to reconnect comes
+    # after up to RECONNECT_MIN seconds and the wait doubles with
+    # every failed attempt up to RECONNECT_MAX. Each wait is
+    # randomized by up to half so that clients that lost the
+    # same server don't all come back at once.
+    RECONNECT_MIN = 0.1
+    RECONNECT_MAX = 30.0
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6868,
+        write_high_water=None,
+        reconnect=False,
+        retry=(),
+        catalog_cache=None,
+        socket_options=None,
+    ):
+        """
+        With reconnect set, a lost connection is reopened in the
+        background instead of ending the read loop. Requests waiting
+        on a reply when the connection drops fail with a
+        ConnectionError, except for those whose verb (get, set or
+        a command name) is in retry, which are sent again once the
+        connection is back. Requests made while reconnecting are
+        held until then.
+
+        get, run and lst give up on a reply after REQUEST_TIMEOUT
+        seconds unless given a timeout of their own, 0 waits forever.
+
+        catalog_cache is a CatalogCache, or the path of its file,
+        to keep the lst catalog between sessions. If it has one
+        for this server, open() uses it straight away and runs
+        lst in the background to bring it up to date.
+
+        host may be "unix:/path" to connect to a Unix domain socket.
+        socket_options are passed to transport.set_options, e.g.
+        dict(rcvbuf=1 << 20, keepalive=(10, 5, 3)). TCP_NODELAY is
+        on unless socket_options has nodelay=False.
+        """
         self.host = host
+        self.socket_options = dict(socket_options or {})
         self.port = port
+        self.reconnect = reconnect
+        self.retry = frozenset(retry)
+        # msgid: request line for requests in retry that are
+        # waiting on a reply.
+        self._retry_lines = {}
+        self._reconnecting = False
+        self.reconnects = 0
+        if write_high_water is None:
+            write_high_water = self.WRITE_HIGH_WATER
+        self.write_high_water = write_high_water
+        # Outgoing lines are corked here until the end of the
+        # current event loop iteration, see _write.
+        self._wbuf = []
+        self._wbuf_size = 0
+        self._flush_handle = None
+        self._drain_task = None
+        self._flushed = None
         self.server_info = dict()
+        self.catalog = Catalog()
+        if catalog_cache is not None and not isinstance(catalog_cache, CatalogCache):
+            catalog_cache = CatalogCache(catalog_cache)
+        self.catalog_cache = catalog_cache
+        # Called with the CatalogDiff whenever the catalog changes.
+        self.catalog_listeners = []
+        # A lst run in the background.
+        self._list_task = None
+        # Seconds the last open() spent connecting and on lst and
+        # the error it failed with, if it did.
+        self.open_timings = dict(connect=None, lst=None)
+        self.open_error = None
         self.running = False
+        # msgid: future for every request still waiting on its
+        # reply and msgid: loop time the request was sent. Both
+        # are in the order the requests were sent.
+        self.outstanding_replies = {}
+        self._sent_at = {}
+        self._reply_timeouts = 0
+        self._reply_cancels = 0
+        self.nextid = 1
+        self.msg_debug_queue = asyncio.Queue(maxsize=self.DEBUG_QUEUE_SIZE)
+        self._reader_task = None
+        # (queue, value) pairs the read loop has to wait to put
+        # before it reads any more, see Subscriber._enqueue.
+        self._blocked = []
+        # Subscriptions whose backlog is full, the read loop waits
+        # for _room before it reads any more, see Subscriber._deliver.
+        self._backlogged = set()
+        self._room = asyncio.Event()
+        # msgid of the lst request whose listing is being
+        # read and the lines of that listing read so far.
+        self._list_msgid = None
+        self._listing = None
+        # msgid: writable memoryview for get_block requests waiting
+        # on their blk header, None for those given up on, and the
+        # block being read: its msgid, destination (None to
+        # discard), length and bytes read.
+        self._blocks = {}
+        self._block = None
 
     async def open(self):
         """
@@ -85,83 +353,567 @@ class MSGClient(object):
         Run lst after opening to populate self.server_info.
         """
         clogger.debug("Opening connection")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.open_timings = dict(connect=None, lst=None)
+        self.open_error = None
         try:
-            self.reader, self.writer = await asyncio.open_connection(
-                self.host, self.port
+            self.reader, self.writer = await transport.open_connection(
+                self.host, self.port, **self.socket_options
             )
         except Exception as e:
             msg = f"Error connecting to MSG server at\
                     {self.host}:{self.port}: {e}"
             clogger.error(msg)
+            self.open_error = e
             self.running = False
             return False
+        connected = loop.time()
+        self.open_timings["connect"] = connected - start
+        self.writer.transport.set_write_buffer_limits(high=self.write_high_water)
         self.running = True
-        await self._list()
+        self._reconnecting = False
+        self._start_reader()
+
+        cached = None
+        if self.catalog_cache is not None:
+            cached = self.catalog_cache.load(self.host, self.port)
+        if cached is None:
+            await self._list()
+        else:
+            clogger.debug(f"Using the cached catalog for {self.host}:{self.port}")
+            self._apply_catalog(cached)
+            self._relist()
+        self.open_timings["lst"] = loop.time() - connected
         return True
 
     async def close(self):
         """
         Closes the connection to the MSG server
         """
-        if not self.running:
+        writer = getattr(self, "writer", None)
+        if writer is None or writer.is_closing():
             clogger.warning("Connection already closed")
+            if writer is not None:
+                self._stop_reader()
         else:
             clogger.debug("Closing connection")
-            self.writer.close()
-            await self.writer.wait_closed()
+            self.running = False
+            self._flush(force=True)
+            self._stop_reader()
+            writer.close()
+            await writer.wait_closed()
+        self.running = False
+
+    def _start_reader(self):
+        """Start the task that reads and dispatches server messages."""
+        self._reader_task = asyncio.get_running_loop().create_task(self._readloop())
+
+    def _closed(self):
+        """
+        True if requests can't be made: not connected, nor
+        reconnecting, when they are held until the connection is
+        back.
+        """
+        return not (self.running or self._reconnecting)
+
+    def _stop_reader(self):
+        if self._reader_task is not None and not self._reader_task.done():
+            self._reader_task.cancel()
+        self._reconnecting = False
+        self._fail_outstanding(ConnectionError("Connection to MSG server closed"))
+
+    def _fail_outstanding(self, error):
+        """Wake up everyone still waiting on a reply with error."""
+        for fut in self.outstanding_replies.values():
+            if not fut.done():
+                fut.set_exception(error)
+        self.outstanding_replies.clear()
+        self._sent_at.clear()
+        self._retry_lines.clear()
+        self._list_msgid = None
+        self._listing = None
+        self._blocks.clear()
+        self._block = None
+
+    async def _readloop(self):
+        """
+        Read and handle data from the msg server until stopped,
+        reconnecting whenever the connection is lost if
+        reconnect is set.
+        """
+        while True:
+            try:
+                if not await self._read():
+                    return
+                clogger.warning("MSG server closed the connection")
+                error = ConnectionError("MSG server closed the connection")
+
+            except Exception as read_error:
+                clogger.warning(f"We have a read error: {[read_error]}")
+                if not self.reconnect:
+                    self._fail_outstanding(read_error)
+                    raise
+                error = read_error
+
+            if not self.reconnect:
+                self.running = False
+                self._fail_outstanding(error)
+                return
+
+            await self._reconnect(error)
+
+    async def _read(self):
+        """
+        Read and handle data from the current connection. Returns
+        True if the server closed the connection and False if we
+        stopped running.
+
+        Data is pulled off the socket in chunks of up to
+        READ_CHUNK bytes. Every complete line in a chunk is
+        handled in one pass and any trailing partial line
+        is carried over to the next read.
+        """
+        rawdata = b""
+
+        while self.running:
+            chunk = await self.reader.read(self.READ_CHUNK)
+            if not chunk:
+                return True
+
+            while chunk:
+                if self._block is not None:
+                    # Raw bytes of a block, see get_block.
+                    chunk = self._fill_block(chunk)
+                    continue
+
+                if b"\n" not in chunk:
+                    rawdata += chunk
+                    break
+
+                lines = (rawdata + chunk).split(b"\n")
+                # The last element is whatever follows the final
+                # newline, i.e. the start of the next line.
+                rawdata = lines.pop()
+                handled = self._handle_lines(lines)
+                if handled is None:
+                    break
+                # A blk header, what follows it is the block.
+                chunk = b"\n".join(lines[handled:] + [rawdata])
+                rawdata = b""
+
+            if self._blocked or self._backlogged:
+                # Back pressure: don't read more until the
+                # callbacks have caught up.
+                await self._unblock()
+
+        return False
+
+    async def _reconnect(self, error):
+        """
+        Connect to the server again after losing the connection
+        with error, backing off between failed attempts. Once
+        connected the requests from _replay and any retried
+        requests go out in one write, ahead of those made while
+        we were reconnecting.
+        """
         self.running = False
+        self._reconnecting = True
+        self.writer.close()
+        resend = self._connection_lost(error)
+
+        delay = self.RECONNECT_MIN
+        attempts = 0
+        while True:
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            attempts += 1
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    transport.open_connection(self.host, self.port, **self.socket_options), self.RECONNECT_MAX
+                )
+                break
+            except (OSError, asyncio.TimeoutError) as connect_error:
+                clogger.info(f"Reconnect attempt {attempts} to {self.host}:{self.port} failed: {connect_error}")
+                delay = min(2 * delay, self.RECONNECT_MAX)
+
+        clogger.warning(f"Reconnected to {self.host}:{self.port} after {attempts} attempts")
+        self.writer.transport.set_write_buffer_limits(high=self.write_high_water)
+        self.running = True
+        self._reconnecting = False
+        self.reconnects += 1
+
+        data = "".join(self._replay() + resend).encode()
+        if data:
+            self._wbuf.insert(0, data)
+            self._wbuf_size += len(data)
+        self._flush()
+
+    def _connection_lost(self, error):
+        """
+        Settle the requests that were waiting on a reply when the
+        connection was lost. Those in retry stay in the reply
+        table and their request lines are returned to be sent
+        again, the rest fail. Anything not yet sent is dropped.
+        """
+        self._wbuf.clear()
+        self._wbuf_size = 0
+
+        retry = {msgid: (self.outstanding_replies.pop(msgid), self._sent_at.pop(msgid)) for msgid in self._retry_lines}
+        retry_lines = self._retry_lines
+        self._retry_lines = {}
+        self._fail_outstanding(ConnectionError(f"Lost connection to MSG server: {error}"))
+
+        for msgid, (fut, sent_at) in retry.items():
+            self.outstanding_replies[msgid] = fut
+            self._sent_at[msgid] = sent_at
+        self._retry_lines = retry_lines
+        return list(retry_lines.values())
+
+    def _replay(self):
+        """
+        Return the request lines that restore our state on a new
+        connection. Subclasses add to this.
+        """
+        return []
+
+    def _handle_lines(self, lines):
+        """
+        Dispatch a batch of complete lines read from the msg
+        server. Lines are handed to parse_msg undecoded so the
+        only decoding done is whatever a consumer asks for.
+
+        Stops at the header of a block and returns the index of
+        the line after it, the rest of the batch is block data.
+        """
+        acknak = None
+        for index, line in enumerate(lines):
+            if self._listing is not None:
+                self._handle_listing(line)
+                continue
+
+            acknak = parse_msg(line)
+            if acknak is None:
+                continue
+            if not self.msg_debug_queue.full():
+                self.msg_debug_queue.put_nowait((line.decode(), acknak))
+            if self._blocks and acknak.msgid in self._blocks and type(acknak) is CMD and acknak.cmd == "blk":
+                self._start_block(acknak)
+                self.last_data = line.decode()
+                return index + 1
+            self._handle_msg(acknak)
+
+        if acknak is not None:
+            self.last_data = line.decode()
+
+    def _start_block(self, header):
+        """Get ready to read the block announced by header."""
+        view = self._blocks.pop(header.msgid)
+        try:
+            length = int(header.args[0])
+        except (IndexError, ValueError):
+            # Nothing we can do but carry on reading lines.
+            self._end_block(header.msgid, RuntimeError(f"Bad block header {header}"))
+            return
+
+        error = None
+        if view is not None and length != len(view):
+            error = RuntimeError(f"Server sent a {length} byte block, not {len(view)}")
+            view = None
+        self._block = [header.msgid, view, length, 0, error]
+        if length == 0:
+            self._fill_block(b"")
+
+    def _fill_block(self, data):
+        """Copy data into the block being read, returns what is left over."""
+        block = self._block
+        msgid, view, length, done, error = block
+        take = min(len(data), length - done)
+        if view is not None and take:
+            view[done:done + take] = memoryview(data)[:take]
+        done += take
+        block[3] = done
+
+        if done == length:
+            self._block = None
+            self._end_block(msgid, length if error is None else error)
+        return data[take:]
+
+    def _end_block(self, msgid, result):
+        fut = self.outstanding_replies.pop(msgid, None)
+        self._sent_at.pop(msgid, None)
+        self._retry_lines.pop(msgid, None)
+        if fut is not None and not fut.done():
+            fut.set_result(result)
+
+    def _handle_listing(self, line):
+        """Collect the lines that follow the ack of a lst."""
+        if line.startswith(b"----LIST----"):
+            fut = self.outstanding_replies.pop(self._list_msgid, None)
+            self._sent_at.pop(self._list_msgid, None)
+            if fut is not None and not fut.done():
+                fut.set_result(self._listing)
+            self._list_msgid = None
+            self._listing = None
+        else:
+            self._listing.append(line.decode())
 
-    async def _writemsg(self, msg):
+    def _handle_msg(self, acknak):
         """
-        Send a message to the MSG server and return the first line
-        returned. The first returned line will have an 'ack' or 'nak'
-        to denote a successful or unsuccessful command. What to do
-        with lines past the first line depends on the specific command.
+        Act on a single message from the msg server. Acks and naks
+        are handed to whoever is waiting on their msgid.
         """
-        self.writer.write(msg.encode())
-        await self.writer.drain()
+        if acknak.msgid in self.outstanding_replies:
+            if type(acknak) is ACK:
+                if acknak.msgid == self._list_msgid:
+                    # The listing follows on the next lines.
+                    self._listing = []
+                    return
+                reply = acknak.args
+            elif type(acknak) is NAK:
+                reply = RuntimeError(f"{acknak.info}")
+            else:
+                raise RuntimeError(f"Expected ack or nak not {acknak}")
+
+            fut = self.outstanding_replies.pop(acknak.msgid)
+            del self._sent_at[acknak.msgid]
+            if self._retry_lines:
+                self._retry_lines.pop(acknak.msgid, None)
+            if self._blocks:
+                self._blocks.pop(acknak.msgid, None)
+            if not fut.done():
+                fut.set_result(reply)
+
+        else:
+            if self._blocks:
+                # A get_block given up on was answered with text.
+                self._blocks.pop(acknak.msgid, None)
+            clogger.warning(f"gracefully ignoring {acknak}")
+
+    def getid(self):
+        """
+        Return the next msgid. Ids run from 1 to MAXID - 1 and
+        wrap around, skipping any that are still waiting on a
+        reply. 0 is never used as servers don't reply to it.
+        """
+        if len(self.outstanding_replies) >= self.MAXID - 1:
+            raise RuntimeError(f"All {self.MAXID - 1} msgids are awaiting replies")
+
+        while True:
+            msgid = self.nextid
+            self.nextid = msgid + 1 if msgid < self.MAXID - 1 else 1
+            if msgid not in self.outstanding_replies and msgid not in self._blocks:
+                return msgid
+
+    def reply_stats(self):
+        """
+        Return the number of requests waiting on a reply, the
+        age in seconds of the oldest of them and the number of
+        requests given up on because of a timeout or because the
+        caller was cancelled.
+        """
+        oldest = 0.0
+        for sent_at in self._sent_at.values():
+            oldest = asyncio.get_running_loop().time() - sent_at
+            break
+
+        return dict(
+            pending=len(self.outstanding_replies),
+            oldest_age=oldest,
+            timeouts=self._reply_timeouts,
+            cancelled=self._reply_cancels,
+        )
+
+    def _write(self, data):
+        """
+        Queue data for the server. Everything written during one
+        iteration of the event loop is corked and handed to the
+        transport as a single write by _flush, which runs once the
+        current callbacks are done.
+        """
+        self._wbuf.append(data)
+        self._wbuf_size += len(data)
+        if self._flush_handle is None and self._drain_task is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self, force=False):
+        """
+        Hand the corked data to the transport. If the transport
+        already holds write_high_water bytes the data stays corked
+        until the transport has drained, so a burst of writes from
+        synchronous code (e.g. subscribing to every published
+        variable) cannot grow the transport buffer without bound.
+        """
+        self._flush_handle = None
+        if not self._wbuf or self._reconnecting:
+            return
+
+        transport = self.writer.transport
+        if not force and transport.get_write_buffer_size() >= self.write_high_water:
+            if self._drain_task is None:
+                self._drain_task = asyncio.get_running_loop().create_task(self._flush_when_drained())
+            return
+
+        data = b"".join(self._wbuf)
+        self._wbuf.clear()
+        self._wbuf_size = 0
+        if not transport.is_closing():
+            self.writer.write(data)
+
+        if self._flushed is not None:
+            if not self._flushed.done():
+                self._flushed.set_result(None)
+            self._flushed = None
+
+    async def _flush_when_drained(self):
+        try:
+            await self.writer.drain()
+        finally:
+            self._drain_task = None
+            self._flush()
+
+    async def _drain(self):
+        """
+        Flow control for coroutines that write. Returns straight
+        away unless the corked data is over write_high_water, in
+        which case it waits for it to reach the transport, and then
+        waits for the transport to drain below write_high_water.
+        """
+        if self._wbuf_size > self.write_high_water:
+            if self._flushed is None:
+                self._flushed = asyncio.get_running_loop().create_future()
+            await self._flushed
+        if not self._reconnecting:
+            await self.writer.drain()
+
+    def _new_request(self):
+        """Allocate a msgid and the future its reply will resolve."""
+        msgid = self.getid()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.outstanding_replies[msgid] = fut
+        self._sent_at[msgid] = loop.time()
+        return msgid, fut
 
-        rawdata = await self.reader.readline()
-        clogger.debug(f"Received: {rawdata.decode()!r}")
-        data = rawdata.decode().split()
-        return data
+    def _send_request(self, request):
+        """
+        Queue request with a fresh msgid and return (msgid, future)
+        where the future resolves to the reply: the args of the
+        ack or a RuntimeError for a nak.
+        """
+        msgid, fut = self._new_request()
+
+        msg = f"{msgid} {request}\n"
+        clogger.debug(msg)
+        if self.retry:
+            self._retry_request(msgid, request, msg)
+        self._write(msg.encode())
+        return msgid, fut
+
+    def _send_requests(self, requests):
+        """
+        Like _send_request but for many requests, which are
+        encoded into one buffer. Returns a list of (msgid, future).
+        """
+        pending = []
+        lines = []
+        for request in requests:
+            msgid, fut = self._new_request()
+            pending.append((msgid, fut))
+            lines.append(f"{msgid} {request}\n")
+            if self.retry:
+                self._retry_request(msgid, request, lines[-1])
+
+        self._write("".join(lines).encode())
+        return pending
+
+    def _retry_request(self, msgid, request, line):
+        """Remember line for resending if request's verb is in retry."""
+        if request.split(None, 1)[0] in self.retry:
+            self._retry_lines[msgid] = line
+
+    def _forget(self, msgid, fut):
+        """Drop the reply table entry for msgid if it is still fut's."""
+        if self.outstanding_replies.get(msgid) is fut:
+            del self.outstanding_replies[msgid]
+            del self._sent_at[msgid]
+            self._retry_lines.pop(msgid, None)
+            if msgid in self._blocks:
+                # Its blk may still come, the bytes must be read
+                # and thrown away rather than taken for lines.
+                self._blocks[msgid] = None
+            block = self._block
+            if block is not None and block[0] == msgid:
+                # Given up on part way, stop writing to the caller's buffer.
+                block[1] = None
+            return True
+        return False
+
+    async def _wait_reply(self, msgid, fut, timeout=None):
+        """
+        Wait for the reply to a request sent with _send_request.
+        Waiting for the request to be written and for its reply
+        share one deadline. If they are not done within timeout
+        seconds, or the caller is cancelled, the request is
+        removed from the reply table so its msgid can be reused.
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                await self._drain()
+                return await fut
+        except asyncio.TimeoutError:
+            if self._forget(msgid, fut):
+                self._reply_timeouts += 1
+            fut.cancel()
+            raise asyncio.TimeoutError(f"No reply to msgid {msgid}") from None
+        except asyncio.CancelledError:
+            if self._forget(msgid, fut):
+                self._reply_cancels += 1
+            raise
+
+    async def _request(self, request, timeout=None, block=None):
+        """
+        Send request and wait for its reply. If block is given
+        the reply may be a block of len(block) bytes, which is
+        read into block.
+        """
+        msgid, fut = self._send_request(request)
+        if block is not None:
+            self._blocks[msgid] = block
+        return await self._wait_reply(msgid, fut, timeout)
 
-    async def get(self, param):
+    async def get(self, param, timeout=None):
         """
         Implement a MSG get to retrieve published value from the MSG server.
-        If the get fails, return None.
+        If the get fails or is not answered within timeout seconds,
+        return None.
         """
-        if not self.running:
+        if self._closed():
             errmsg = "MSG server not currently connected."
             raise ValueError(errmsg)
         if param not in self.server_info["published"]:
             errmsg = f"{param} not published by MSG server\
                     {self.server_info['name']}"
             raise ValueError(errmsg)
-        msg = f"1 get {param}\n"
-        data = await self._writemsg(msg)
-        if int(data[0]) == 1 and data[1] == "ack":
-            if len(data) == 2:
-                clogger.debug(f"Returned empty result for {param}")
-                value = None
-            if len(data) == 3:
-                value = data[2]
-                clogger.debug(f"Got {param} = {value}")
-            else:
-                value = " ".join(data[2:])
-                clogger.debug(f"Got {param} = {value}")
-        else:
+        try:
+            data = await self._request(f"get {param}", self._timeout(timeout))
+        except asyncio.TimeoutError as error:
+            data = error
+        if isinstance(data, Exception):
             clogger.debug(f"Failed to get {param} from MSG server")
             value = None
+        else:
+            value = " ".join(data)
+            clogger.debug(f"Got {param} = {value}")
         return value
 
-    async def run(self, command, *pars):
+    async def run(self, command, *pars, timeout=None):
         """
         Implement running an MSG command. Only an 'ack' or a 'nak'
         are returned so check that to see if command was succesful.
-        Return True or False accordingly.
+        Return True or False accordingly, False too if there is no
+        reply within timeout seconds.
         """
-        if not self.running:
+        if self._closed():
             errmsg = "MSG server not currently connected."
             raise ValueError(errmsg)
         if command not in self.server_info["registered"]:
@@ -170,21 +922,24 @@ class MSGClient(object):
             raise ValueError(errmsg)
         if len(pars) > 0:
             params = " ".join(str(x) for x in pars)
-            msg = f"1 {command} {params}\n"
+            request = f"{command} {params}"
         else:
             params = "<None>"
-            msg = f"1 {command}\n"
-        data = await self._writemsg(msg)
+            request = command
+        try:
+            data = await self._request(request, self._timeout(timeout))
+        except asyncio.TimeoutError as error:
+            data = error
 
-        if int(data[0]) == 1 and data[1] == "ack":
-            value = True
-            clogger.debug(f"Successfully ran {command} with params {params}")
-        else:
+        if isinstance(data, Exception):
             clogger.debug(
                 f"Failed to run {command} with params\
                     {params} on MSG server"
             )
             value = False
+        else:
+            value = True
+            clogger.debug(f"Successfully ran {command} with params {params}")
         return value
 
     async def _list(self):
@@ -194,165 +949,665 @@ class MSGClient(object):
         if not self.running:
             errmsg = "MSG server not currently connected"
             raise ValueError(errmsg)
-        msg = "1 lst\n"
-        data = await self._writemsg(msg)
-        if int(data[0]) == 1 and data[1] == "ack":
-            self.server_info["published"] = list()
-            self.server_info["registered"] = list()
-
-            while True:
-                rawdata = await self.reader.readline()
-                line = rawdata.decode()
-                if "----LIST----" in line:
-                    break
-                if "server" in line:
-                    self.server_info["name"] = line.split()[1]
-                if "published" in line:
-                    var = line.split()[1]
-                    self.server_info["published"].append(var)
-                if "registered" in line:
-                    var = line.split()[1]
-                    self.server_info["registered"].append(var)
+        msgid, fut = self._send_request("lst")
+        self._list_msgid = msgid
+        lines = await self._wait_reply(msgid, fut, self._timeout(None))
+        if isinstance(lines, Exception):
+            clogger.error(f"lst failed: {lines}")
+            return
+
+        catalog = Catalog.from_listing(lines)
+        self._apply_catalog(catalog)
+        if self.catalog_cache is not None:
+            try:
+                self.catalog_cache.store(self.host, self.port, catalog)
+            except OSError as error:
+                clogger.warning(f"Could not save the catalog: {error}")
+
+    def _timeout(self, timeout):
+        """The timeout for _request: timeout, REQUEST_TIMEOUT if None, or None for 0."""
+        if timeout is None:
+            timeout = self.REQUEST_TIMEOUT
+        return timeout or None
+
+    def _relist(self):
+        """Run lst in the background unless it already is."""
+        if self._list_task is None or self._list_task.done():
+            self._list_task = asyncio.get_running_loop().create_task(self._list())
+            self._list_task.add_done_callback(_retrieve)
+
+    def _apply_catalog(self, catalog):
+        """
+        Bring self.catalog in line with catalog, changing only the
+        entries that differ, and tell self.catalog_listeners what
+        changed. server_info["published"] and ["registered"] are its
+        read-only name: Entry mappings, which behave like the lists
+        of names they used to be for lookups and iteration.
+        """
+        diff = self.catalog.diff(catalog)
+        if diff:
+            if diff.server is not None and self.catalog.server is not None:
+                clogger.warning(f"{self.host}:{self.port} is now {diff.server[0]} not {self.catalog.server}")
+            self.catalog.apply(diff)
+        if self.catalog.server is not None:
+            self.server_info["name"] = self.catalog.server
+        self.server_info["published"] = self.catalog.published
+        self.server_info["registered"] = self.catalog.registered
+
+        if diff:
+            for listener in self.catalog_listeners:
+                try:
+                    listener(diff)
+                except Exception as error:
+                    clogger.error(f"Catalog listener {getattr(listener, '__name__', listener)} failed: {error}")
 
 
 # Subscriber class
 class Subscriber(MSGClient):
     """
     This class expands on the MSGClient class by allowing
-    for more asynchronous communication. This is done by
-    having a run-forever loop that reads from the MSG
-    server. All get or subscribe queries are given
-    a msgid. The read loop then matches ACKs with
-    the msgid and sends the response to the appropriate
-    asyncio queue.
+    for more asynchronous communication. On top of the
+    request/reply handling of MSGClient, values published
+    to subscribed variables are cached and handed to their
+    callbacks as they arrive.
     """
 
-    MAXID = 100000
+    # Caps on the number of coroutine callbacks running at once,
+    # for a single param and for all of them together. Values
+    # that arrive while a param is at its cap wait their turn, or
+    # are conflated if the subscription asked for that.
+    MAX_TASKS = 1000
+    MAX_TASKS_PER_PARAM = 10
+
+    # The connection is taken to be hung after this many
+    # heartbeats in a row go unanswered.
+    HEARTBEAT_MISSES = 3
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6868,
+        max_tasks=None,
+        max_tasks_per_param=None,
+        single_flight=False,
+        fresh_window=0.0,
+        heartbeat=None,
+        heartbeat_misses=None,
+        timeouts=None,
+        **kwargs,
+    ):
+        """
+        With single_flight set, a get() for a param that already
+        has a get in flight waits for that reply instead of sending
+        another request. A reply to such a get is also handed to
+        callers that ask for it up to fresh_window seconds later.
+
+        With heartbeat set, the server is sent an ack every
+        heartbeat seconds, like msg_keepalive does, to measure the
+        round trip time (see rtt_stats). An ack not answered before
+        the next one is due is a miss and after heartbeat_misses
+        misses in a row the connection is dropped as hung, which
+        ends mainloop or, with reconnect, reconnects.
+
+        run, get and set calls made without a timeout get one
+        from timeouts, an AdaptiveTimeouts that learns how long
+        each command and param takes to answer. Pass an
+        AdaptiveTimeouts with a path to keep what is learned
+        between sessions (it is saved by stop() and close()), or
+        False to wait for replies forever.
+        """
+        super().__init__(host, port, **kwargs)
+        if timeouts is None:
+            timeouts = AdaptiveTimeouts()
+        self.timeouts = timeouts
+        self.heartbeat = heartbeat
+        if heartbeat_misses is None:
+            heartbeat_misses = self.HEARTBEAT_MISSES
+        self.heartbeat_misses = heartbeat_misses
+        self._heartbeat_task = None
+        self.rtt = RTTEstimator()
+        self._misses = 0
+        self._missed = 0
+        self._hangs = 0
+        self.single_flight = single_flight
+        self.fresh_window = fresh_window
+        # param: task of the get in flight, and param: (loop time
+        # the reply arrived, reply) for single_flight.
+        self._gets_in_flight = {}
+        self._recent_gets = {}
+        # param: (value, time.monotonic() when it arrived) for
+        # subscribed params that have been posted.
+        self._received = {}
+        # msgid: Subscription for sub requests waiting on their ack.
+        self._sub_acks = {}
+        self.subscriptions = {}
+        self.max_tasks = self.MAX_TASKS if max_tasks is None else max_tasks
+        if max_tasks_per_param is None:
+            max_tasks_per_param = self.MAX_TASKS_PER_PARAM
+        self.max_tasks_per_param = max_tasks_per_param
+        self.tasks = set()
+        # Subscriptions with a value pending because MAX_TASKS
+        # was reached, as keys in the order they hit the cap.
+        self._waiting = {}
 
     async def open(self):
+        for sub in self.subscriptions.values():
+            self._drop_worker(sub)
+        self.server_info["subscribed"] = PostedValues()
+        self.subscriptions = {}
+        self._received = {}
+        self._sub_acks = {}
+        self.tasks = set()
+        self.executors = {}
+
+        opened = await super().open()
+        if opened and self.heartbeat:
+            self._misses = 0
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeats())
+        return opened
+
+    async def _heartbeats(self):
+        """Ping the server every self.heartbeat seconds until stopped."""
+        loop = asyncio.get_running_loop()
+        while not self._reader_task.done():
+            await asyncio.sleep(self.heartbeat)
+            if not self.running:
+                # Reconnecting.
+                self._misses = 0
+                continue
 
-        isOpen = await super().open()
-        if isOpen:
-            self.server_info["subscribed"] = {}
-            self.callbacks = {}
-            self.tasks = []
-            self.outstanding_replies = {}
-            self.nextid = 1
+            msgid, fut = self._send_request("ack")
+            sent = loop.time()
+            try:
+                await self._wait_reply(msgid, fut, self.heartbeat)
+            except asyncio.TimeoutError:
+                self._misses += 1
+                self._missed += 1
+                clogger.warning(f"Heartbeat {self._misses} of {self.heartbeat_misses} to {self.host}:{self.port} missed")
+                if self._misses >= self.heartbeat_misses and self.running:
+                    clogger.error(f"MSG server {self.host}:{self.port} is hung, dropping the connection")
+                    self._hangs += 1
+                    self._misses = 0
+                    self.writer.transport.abort()
+                continue
+            except ConnectionError:
+                continue
 
-        return isOpen
+            self._misses = 0
+            self.rtt.update(loop.time() - sent)
 
-    def subscribe(self, param, callback=None):
+    def rtt_stats(self):
+        """
+        Return the round trip time statistics gathered by the
+        heartbeat (see RTTEstimator.stats), in seconds, along with
+        the number of heartbeats missed, the current run of misses
+        and the number of times the connection was found hung.
+        """
+        stats = self.rtt.stats()
+        stats.update(missed=self._missed, misses=self._misses, hangs=self._hangs)
+        return stats
+
+    def _stop_reader(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self.timeouts:
+            try:
+                self.timeouts.save()
+            except OSError as error:
+                clogger.warning(f"Could not save timeouts: {error}")
+        for task in list(self.tasks):
+            task.cancel("Cancelled due to the Subscriber stopping.")
+        for sub in self.subscriptions.values():
+            self._drop_worker(sub)
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.executors.clear()
+        super()._stop_reader()
+
+    def subscribe(
+        self,
+        param,
+        callback=None,
+        min_interval=None,
+        period=None,
+        conflate=False,
+        executor=None,
+        max_pending=100,
+        on_result=None,
+    ):
         """Subscribe to a msg variable with optional callback. The
         callback should be a coroutine that excepts the value of
         the variable as its only argument. The Callback should not
         be CPU intensive or we will bog down the mainloop. If we
         want to do CPU bound stuff we will need to come up with a
-        way to run the callbacks in the executor."""
-
-        msgid = self.getid()
+        way to run the callbacks in the executor.
+
+        How often the server posts the variable can be set with
+        one of (both in seconds):
+
+        min_interval: post changes, but no more often than
+            this. 0 posts every change.
+        period: post the current value every period seconds
+            whether it changed or not. The Tcl server only
+            accepts whole seconds here.
+
+        Without either the server default is used, which for
+        msg.tcl is a min_interval of 1 second. The server does
+        the throttling so suppressed updates never cross the
+        wire.
+
+        If the callback can be slower than the updates, set
+        conflate to have at most one call to it in flight. It
+        is then called with the newest value once the previous
+        call is done and the values in between are skipped and
+        counted in self.subscriptions[param].dropped.
+
+        CPU bound callbacks can be run off the event loop by
+        giving an executor: "thread" or "process" for pools
+        shared by this Subscriber, or any concurrent.futures
+        Executor. The callback must then be a plain function
+        (picklable for "process"). It is called with one value
+        at a time, in order, and its return value is passed to
+        on_result back on the event loop.
+
+        Values for a callback that is busy (an executor callback,
+        or a coroutine at MAX_TASKS_PER_PARAM or MAX_TASKS) wait
+        their turn. Up to max_pending values wait; past that the
+        read loop stops reading from the server until there is
+        room again. Nothing is dropped unless conflate is set.
+
+        The server acks the sub with the current value, which is
+        cached and handed to the callback like any post. Returns
+        a future that resolves to that value once the ack is in,
+        or to a RuntimeError if the server refused the sub."""
+
+        update = self._update_arg(min_interval, period)
+        executor = self._get_executor(executor)
+        if executor is not None and inspect.iscoroutinefunction(callback):
+            raise ValueError("Callbacks run in an executor cannot be coroutines")
 
         if param not in self.server_info["published"]:
             errmsg = f"{param} not published by MSG\
                     server {self.server_info['name']}"
             raise ValueError(errmsg)
 
-        if param not in self.server_info["subscribed"]:
+        if param not in self.subscriptions:
             self.server_info["subscribed"][param] = None
             if callback is not None:
                 clogger.debug(f"subscribing to {param} fxn={callback}")
-                self.callbacks[param] = callback
+            sub = Subscription(param, callback, update, conflate, max_pending=max_pending)
+            self.subscriptions[param] = sub
+            if executor is not None and callback is not None:
+                sub.executor = executor
+                sub.queue = asyncio.Queue(maxsize=max_pending)
+                sub.on_result = on_result
+                # Not in self.tasks, it is not a callback.
+                sub.worker = asyncio.get_running_loop().create_task(self._executor_worker(sub))
+
+            self._write(self._sub_request(sub).encode())
+
+        return self.subscriptions[param].ready
+
+    def _sub_request(self, sub):
+        """Return the sub request line for sub and track its ack."""
+        msgid, sub.ready = self._new_request()
+        self._sub_acks[msgid] = sub
+        sub.echo = None
+        # Nobody has to wait on the ack, don't let a lost
+        # connection be logged as an unretrieved exception.
+        sub.ready.add_done_callback(_retrieve)
+
+        if sub.update is None:
+            return f"{msgid} sub {sub.param}\n"
+        return f"{msgid} sub {sub.param} {sub.update}\n"
+
+    def _replay(self):
+        """
+        Subscribe again to everything on a new connection, except
+        subscriptions made while reconnecting, whose sub is
+        already waiting to be sent.
+        """
+        queued = {sub.param for sub in self._sub_acks.values()}
+        return super()._replay() + [
+            self._sub_request(sub) for sub in self.subscriptions.values() if sub.param not in queued
+        ]
+
+    def _get_executor(self, executor):
+        """Resolve the executor argument of subscribe."""
+        if executor is None or executor == "inline":
+            return None
+        if isinstance(executor, concurrent.futures.Executor):
+            return executor
+        if executor not in ("thread", "process"):
+            raise ValueError(f"executor must be inline, thread, process or an Executor not {executor!r}")
+
+        if executor not in self.executors:
+            if executor == "thread":
+                self.executors[executor] = concurrent.futures.ThreadPoolExecutor(
+                    thread_name_prefix=f"msg-{self.host}:{self.port}"
+                )
+            else:
+                self.executors[executor] = concurrent.futures.ProcessPoolExecutor()
+        return self.executors[executor]
+
+    @staticmethod
+    def _drop_worker(sub):
+        """Stop the executor worker of a subscription that is going away."""
+        if sub.worker is not None:
+            sub.worker.cancel()
+            sub.worker = None
+
+    async def _executor_worker(self, sub):
+        """Feed the values queued for sub to its executor one at a time."""
+        loop = asyncio.get_running_loop()
+        while True:
+            value = await sub.queue.get()
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(sub.executor, sub.callback, value)
+            except Exception as error:
+                self._record(sub, start, error)
+                continue
+            self._record(sub, start)
+
+            if sub.on_result is not None:
+                if inspect.iscoroutinefunction(sub.on_result):
+                    self._track(loop.create_task(sub.on_result(result)))
+                else:
+                    sub.on_result(result)
+
+    @staticmethod
+    def _update_arg(min_interval, period):
+        """
+        Translate min_interval/period into the update argument
+        of a MSG sub request: a positive update is a minimum
+        interval between posts and a negative one a period.
+        """
+        if min_interval is not None and period is not None:
+            raise ValueError("Give at most one of min_interval and period")
+
+        if min_interval is not None:
+            if min_interval < 0:
+                raise ValueError(f"min_interval must be >= 0 not {min_interval}")
+            return min_interval
+
+        if period is not None:
+            if period <= 0:
+                raise ValueError(f"period must be > 0 not {period}")
+            if period != int(period):
+                raise ValueError(f"period must be a whole number of seconds not {period}")
+            return -int(period)
 
-            self.writer.write(f"{msgid} sub {param}\n".encode())
+        return None
 
     def unsubscribe(self, param):
 
-        if param in self.server_info["subscribed"]:
+        if param in self.subscriptions:
             msgid = self.getid()
-            del self.server_info["subscribed"]
-            self.writer.write(f"{msgid} uns {param}\n".encode())
+            self.server_info["subscribed"].pop(param, None)
+            sub = self.subscriptions.pop(param)
+            self._drop_worker(sub)
+            self._drop_values(sub)
+            self._received.pop(param, None)
+            self._write(f"{msgid} uns {param}\n".encode())
 
     async def mainloop(self, timeout=None):
-        """Read and handle data from msg server."""
-        self.msg_debug_queue = asyncio.Queue()
-
-        if not self.running:
+        """
+        Wait on the task, started by open(), that reads and
+        handles data from the msg server. Returns when stop()
+        is called or the server hangs up.
+        """
+        if self._reader_task is None:
             raise RuntimeError("Must call open() before mainloop()")
 
-        rawdata = b""
-
-        while self.running:
-            try:
-                rawdata += await asyncio.wait_for(self.reader.read(1), 5.0)
+        try:
+            await self._reader_task
+        except asyncio.CancelledError:
+            # stop() cancels the reader, anything else is
+            # someone cancelling us.
+            if self.running:
+                raise
+
+    def _handle_msg(self, acknak):
+        """Act on a single message from the msg server."""
+        # SET is used for subscribed parameters.
+        if type(acknak) is SET:
+            sub = self.subscriptions.get(acknak.param)
+            if sub is None:
+                # Posted before the server saw our uns.
+                clogger.debug(f"Ignoring post of unsubscribed {acknak.param}")
+                return
+
+            if sub.echo is not None:
+                # The server follows the sub ack with a post of the
+                # same value, which has already been delivered.
+                echo, sub.echo = sub.echo, None
+                if acknak.value == echo:
+                    self._received[acknak.param] = (echo, time.monotonic())
+                    return
+
+            # Decoded when someone asks, see PostedValues and cached().
+            self.server_info["subscribed"][acknak.param] = acknak
+            self._received[acknak.param] = (acknak, time.monotonic())
+            clogger.debug(f"We have a subscribed acknack {acknak.param}")
+
+            if sub.callback is not None:
+                self._deliver(sub, acknak.value)
+
+        # Other msg reads should be from run commands, gets.
+        # or sets.
+        elif acknak.msgid in self.outstanding_replies:
+            sub = self._sub_acks.pop(acknak.msgid, None)
+            if sub is not None:
+                self._subscribed(sub, acknak)
+            super()._handle_msg(acknak)
 
-            except asyncio.TimeoutError:
-                # Give us a chance to check the loop.
-                clogger.debug("timeout")
-                continue
+        else:
+            clogger.warning(f"gracefully ignoring {acknak}")
 
-            except Exception as error:
-                clogger.warn(f"We have a read error: {[error]}")
-                raise error
+    def _subscribed(self, sub, acknak):
+        """
+        Handle the server's reply to the sub request of sub. An
+        ack carries the current value, which is delivered like a
+        post.
+        """
+        if self.subscriptions.get(sub.param) is not sub:
+            # Unsubscribed while the sub was in flight.
+            return
+
+        if type(acknak) is NAK:
+            clogger.warning(f"Server refused sub {sub.param}: {acknak.info}")
+            self._drop_worker(self.subscriptions.pop(sub.param))
+            self.server_info["subscribed"].pop(sub.param, None)
+            self._received.pop(sub.param, None)
+            # param was in our listing, so the server's has changed
+            # (e.g. it was restarted without it). Read it again.
+            self._relist()
+            return
+
+        value = acknak.args
+        self.server_info["subscribed"][sub.param] = acknak.raw.decode().strip()
+        self._received[sub.param] = (value, time.monotonic())
+        sub.echo = value
+        if sub.callback is not None:
+            self._deliver(sub, value)
+
+    def _fail_outstanding(self, error):
+        super()._fail_outstanding(error)
+        self._sub_acks.clear()
+
+    def _deliver(self, sub, value):
+        """Hand value to the callback of subscription sub."""
+        if sub.queue is not None:
+            self._enqueue(sub, value)
+            return
+
+        if sub.conflate:
+            limit = 1
+        elif sub.is_coroutine:
+            limit = self.max_tasks_per_param
+        else:
+            limit = None
+
+        if limit is not None:
+            at_global_cap = sub.is_coroutine and len(self.tasks) >= self.max_tasks
+            if sub.inflight >= limit or at_global_cap or sub.backlog:
+                if at_global_cap:
+                    self._waiting.setdefault(sub)
+                if not sub.conflate:
+                    sub.backlog.append(value)
+                    if len(sub.backlog) >= sub.max_pending:
+                        self._backlogged.add(sub)
+                    return
+                if sub.pending is not None:
+                    sub.dropped += 1
+                sub.pending = value
+                return
+            sub.inflight += 1
+
+        self._start(sub, value)
+
+    def _start(self, sub, value):
+        """Call the callback of sub with value."""
+        cb = sub.callback
+        loop = asyncio.get_running_loop()
+        clogger.debug(
+            f"Calling {getattr(cb, '__name__', cb)} with {sub.param} value {value}"
+        )
+        if sub.is_coroutine:
+            task = loop.create_task(cb(*value))
+            self.tasks.add(task)
+            task.add_done_callback(functools.partial(self._task_done, sub, time.perf_counter()))
 
-            data = rawdata.decode()
+        else:
+            loop.call_soon(self._call, sub, value)
 
-            if rawdata.endswith(b"\n"):
-                rawdata = b""
-            else:
-                continue
+    def _call(self, sub, value):
+        """Run a plain (not coroutine) callback."""
+        start = time.perf_counter()
+        try:
+            sub.callback(value)
+        except Exception as error:
+            self._record(sub, start, error)
+        else:
+            self._record(sub, start)
+        finally:
+            if sub.conflate:
+                sub.inflight -= 1
+                self._release(sub)
+
+    def _task_done(self, sub, start, task):
+        """Done callback of a coroutine callback's task."""
+        self.tasks.discard(task)
+        sub.inflight -= 1
+        if task.cancelled():
+            self._record(sub, start)
+        else:
+            self._record(sub, start, task.exception())
+        self._release(sub)
 
-            self.last_data = data
-            acknak = msg_factory(data)
-            try:
-                self.msg_debug_queue.put_nowait((data, acknak))
-            except asyncio.QueueEmpty:
-                pass
-
-            # SET is used for subscribed parameters.
-            if type(acknak) is SET:
-                self.server_info["subscribed"][acknak.param] = " ".join(acknak.value)
-                clogger.debug(f"We have a subscribed acknack {acknak.param}")
-
-                if acknak.param in self.callbacks:
-                    cb = self.callbacks[acknak.param]
-                    loop = asyncio.get_running_loop()
-                    clogger.debug(
-                        f"Calling {cb.__name__} ({cb.__doc__})\
-                                    with {acknak.param} value {acknak.value}"
-                    )
-                    if inspect.iscoroutinefunction(cb):
-                        task = loop.create_task(cb(*acknak.value))
-                        self.tasks.append(task)
-
-                    else:
-                        loop.call_soon(cb, acknak.value)
-
-            # Other msg reads should be from run commands, gets.
-            # or sets. Check to see if anyone is waiting for a reply.
-            elif acknak.msgid in self.outstanding_replies:
-                aq = self.outstanding_replies[acknak.msgid]
-                if type(acknak) is ACK:
-                    reply = acknak.args
-                elif type(acknak) is NAK:
-                    reply = RuntimeError(f"{acknak.info}")
-                else:
-                    raise RuntimeError(f"Expected ack or nak not {acknak}")
+        while self._waiting and len(self.tasks) < self.max_tasks:
+            waiting = next(iter(self._waiting))
+            del self._waiting[waiting]
+            self._release(waiting)
 
-                await aq.put(reply)
-                del self.outstanding_replies[acknak.msgid]
+    def _release(self, sub):
+        """A callback is done, pass on the newest pending value or the backlog."""
+        if not self.running:
+            return
+        if sub.pending is not None:
+            value, sub.pending = sub.pending, None
+            self._deliver(sub, value)
+
+        while sub.backlog and sub.inflight < self.max_tasks_per_param:
+            if len(self.tasks) >= self.max_tasks:
+                self._waiting.setdefault(sub)
+                break
+            sub.inflight += 1
+            self._start(sub, sub.backlog.popleft())
+
+        if sub in self._backlogged and len(sub.backlog) < sub.max_pending:
+            self._make_room(sub)
+
+    def _make_room(self, sub):
+        """sub's backlog has room, let the read loop go on if it was the last one full."""
+        self._backlogged.discard(sub)
+        if not self._backlogged:
+            self._room.set()
+
+    def _drop_values(self, sub):
+        """Throw away the values waiting for the callback of sub, which is going away."""
+        sub.backlog.clear()
+        sub.pending = None
+        self._waiting.pop(sub, None)
+        self._make_room(sub)
+
+    def _record(self, sub, start, error=None):
+        """Account for one call of sub's callback that began at start."""
+        elapsed = time.perf_counter() - start
+        sub.calls += 1
+        sub.busy_time += elapsed
+        if elapsed > sub.max_time:
+            sub.max_time = elapsed
+        if error is not None:
+            sub.errors += 1
+            sub.last_error = error
+            clogger.error(f"Callback for {sub.param} failed: {error!r}")
+
+    def _track(self, task):
+        """Keep a reference to task until it is done."""
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def callback_stats(self):
+        """
+        Return a dict of per param callback statistics: the number
+        of calls, errors and dropped values, the total and longest
+        time spent in the callback, the last exception raised and
+        the number of values waiting for the callback.
+        """
+        return {
+            param: dict(
+                calls=sub.calls,
+                errors=sub.errors,
+                dropped=sub.dropped,
+                busy_time=sub.busy_time,
+                max_time=sub.max_time,
+                last_error=sub.last_error,
+                inflight=sub.inflight,
+                queued=len(sub.backlog),
+            )
+            for param, sub in self.subscriptions.items()
+            if sub.callback is not None
+        }
+
+    def _enqueue(self, sub, value):
+        """Queue value for a callback that runs in an executor."""
+        queue = sub.queue
+        if queue.full() and sub.conflate:
+            queue.get_nowait()
+            sub.dropped += 1
+
+        # Once anything is blocked everything after it has to
+        # wait too, or values would be handed over out of order.
+        if self._blocked or queue.full():
+            self._blocked.append((queue, value))
+        else:
+            queue.put_nowait(value)
 
-            else:
-                # TODO
-                # When you subscribe to a variable the server
-                # Imediately responds with an ack and the inital value.
-                # We currently Don't have a means of capturing this
-                # value so it is gracefully ignored. We need to
-                # find a way to capture it and apply the callback.
-                clogger.warn(f"gracefully ignoring {acknak}")
+    async def _unblock(self):
+        """Wait for room for the values that did not fit in their queues."""
+        blocked, self._blocked = self._blocked, []
+        for queue, value in blocked:
+            await queue.put(value)
+        while self._backlogged:
+            self._room.clear()
+            await self._room.wait()
 
     async def stop(self):
         self.running = False
-        for task in self.tasks:
-            task.cancel("Cancelled due to stop() being called.")
+        self._stop_reader()
 
         await asyncio.sleep(0.5)
 
@@ -373,70 +1628,286 @@ class Subscriber(MSGClient):
             raise ValueError(errmsg)
         params = " ".join(str(x) for x in pars)
 
-        msgid = self.getid()
+        msg = f"{command} {params}"
+        resp = await self._timed_request(command, msg, timeout)
 
-        aq = asyncio.Queue()
-        self.outstanding_replies[msgid] = aq
+        if isinstance(resp, Exception):
+            raise RuntimeError(f"{str(resp)} {msg}")
 
-        msg = f"{msgid} {command} {params}\n"
+        return resp
 
-        clogger.debug(msg)
-        self.writer.write(msg.encode())
-        await self.writer.drain()
+    async def _timed_request(self, key, request, timeout=None, block=None):
+        """
+        Send request and wait for its reply for timeout seconds,
+        or for as long as self.timeouts allows for key if timeout
+        is None. 0 waits forever. The time taken is fed back to
+        self.timeouts.
+        """
+        if not self.timeouts:
+            return await self._request(request, timeout or None, block)
 
-        if timeout:
-            resp = await asyncio.wait_for(aq.get(), timeout)
-        else:
-            resp = await aq.get()
+        if timeout is None:
+            timeout = self.timeouts.timeout(key)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            reply = await self._request(request, timeout or None, block)
+        except asyncio.TimeoutError:
+            self.timeouts.expired(key)
+            raise
 
-        if isinstance(resp, Exception):
-            raise RuntimeError(f"{str(resp)} msg={msg}")
+        self.timeouts.observe(key, loop.time() - start)
+        return reply
 
-        return resp
+    def cached(self, param):
+        """
+        Return (value, received) for the last value posted to
+        the subscribed param, where received is the
+        time.monotonic() it arrived, or None if nothing has
+        been posted yet.
+        """
+        cached = self._received.get(param)
+        if cached is not None and type(cached[0]) is SET:
+            cached = self._received[param] = (cached[0].value, cached[1])
+        return cached
 
-    def getid(self):
-        msgid = self.nextid
-        self.nextid += 1
-        self.nextid %= self.MAXID
-        return msgid
+    async def get(self, param, timeout=None, max_age=None):
+        """
+        Get the value of param. With max_age, a value posted
+        to a subscription on param no more than max_age seconds
+        ago is returned without asking the server. Subscriptions
+        only post changes, so max_age=math.inf trusts the
+        subscription to be current.
+        """
+        if max_age is not None and self.running:
+            cached = self.cached(param)
+            if cached is not None and time.monotonic() - cached[1] <= max_age:
+                return list(cached[0])
 
-    async def get(self, param):
+        if self.single_flight:
+            return await self._shared_get(param, timeout)
 
-        msgid = self.getid()
+        return await self._timed_request(f"get {param}", f"get {param}", timeout)
 
-        aq = asyncio.Queue()
+    async def get_block(self, param, length, out=None, timeout=None):
+        """
+        Get a block of length raw bytes from param, as msg_blk
+        does. The server answers "<msgid> blk <length>" followed
+        by the bytes themselves, which are copied straight from
+        the socket reads into out, any writable contiguous buffer
+        of at least length bytes (a bytearray, a numpy array,
+        ...). Without out a new bytearray is used. Returns the
+        buffer.
+        """
+        if out is None:
+            out = bytearray(length)
+        view = memoryview(out).cast("B")
+        if view.readonly:
+            raise TypeError("out must be a writable buffer")
+        if view.nbytes < length:
+            raise ValueError(f"out holds {view.nbytes} bytes, a {length} byte block does not fit")
+
+        reply = await self._timed_request(f"blk {param}", f"get {param} {length}", timeout, view[:length])
+        if isinstance(reply, Exception):
+            raise RuntimeError(f"get_block {param} {length} failed: {reply}")
+        if not isinstance(reply, int):
+            raise RuntimeError(f"Server answered get_block {param} {length} with text not a block: {reply}")
+        return out
+
+    async def _shared_get(self, param, timeout=None):
+        """get() for single_flight mode."""
+        loop = asyncio.get_running_loop()
+        recent = self._recent_gets.get(param)
+        if recent is not None and loop.time() - recent[0] <= self.fresh_window:
+            return list(recent[1])
+
+        task = self._gets_in_flight.get(param)
+        if task is None:
+            # The request runs in a task of its own so that one
+            # caller being cancelled doesn't cancel it for the rest.
+            # It waits as long as the first caller is willing to,
+            # later ones may give up sooner.
+            task = loop.create_task(self._timed_request(f"get {param}", f"get {param}", timeout))
+            self._gets_in_flight[param] = task
+            task.add_done_callback(functools.partial(self._shared_get_done, param))
+            reply = await asyncio.shield(task)
+        else:
+            if timeout is None and self.timeouts:
+                timeout = self.timeouts.timeout(f"get {param}")
+            reply = await asyncio.wait_for(asyncio.shield(task), timeout or None)
+        return list(reply) if isinstance(reply, list) else reply
+
+    def _shared_get_done(self, param, task):
+        del self._gets_in_flight[param]
+        # Retrieved here in case every caller has gone.
+        _retrieve(task)
+        if self.fresh_window and not task.cancelled() and task.exception() is None:
+            reply = task.result()
+            if isinstance(reply, list):
+                self._recent_gets[param] = (asyncio.get_running_loop().time(), reply)
+
+    async def _request_many(self, keys, requests, timeout=None):
+        """
+        Send requests with one write and drain and return a
+        dict mapping each key to its reply. A nak, a lost
+        connection or no reply within timeout seconds shows up as
+        an exception in the dict rather than being raised, so one
+        failure does not cost the other results.
+        """
+        pending = self._send_requests(requests)
+        timeout = self._timeout(timeout)
+        replies = await asyncio.gather(
+            *(self._wait_reply(msgid, fut, timeout) for msgid, fut in pending), return_exceptions=True
+        )
+        return dict(zip(keys, replies))
+
+    async def get_many(self, params, timeout=None):
+        """
+        Get many published values at once. All the gets go
+        out in a single write and the replies are collected
+        into a dict of param: value, or param: RuntimeError
+        for any the server refused and param: TimeoutError for
+        any not answered within timeout seconds (REQUEST_TIMEOUT
+        by default, 0 waits forever).
+        """
+        params = list(dict.fromkeys(params))
+        return await self._request_many(params, (f"get {param}" for param in params), timeout)
 
-        self.outstanding_replies[msgid] = aq
-        self.writer.write(f"{msgid} get {param}\n".encode())
-        await self.writer.drain()
+    async def set_many(self, mapping, timeout=None):
+        """
+        Set many values at once, see get_many. mapping is a
+        dict of param: value where each value is a str.
+        """
+        for param, value in mapping.items():
+            if not isinstance(value, str):
+                raise TypeError(f"value for {param} must be of type str not {type(value)}")
 
-        return await aq.get()
+        return await self._request_many(
+            list(mapping), (f"set {param} {value}" for param, value in mapping.items()), timeout
+        )
 
-    async def set(self, param, value):
+    async def set(self, param, value, timeout=None):
 
         if not isinstance(value, str):
             raise TypeError(f"value arg must be of type str not {type(value)}")
 
-        msgid = self.getid()
+        return await self._timed_request(f"set {param}", f"set {param} {value}", timeout)
+
+
+@dataclass
+class ConnectReport:
+    """
+    How connecting to one server went for connect_all. client
+    is the open Subscriber, None until it is up or if it failed
+    with error. connect and lst are the seconds open() spent on
+    each, done is False while it is still being tried.
+    """
+
+    host: str
+    port: int
+    client: typing.Union[MSGClient, None] = None
+    connect: typing.Union[float, None] = None
+    lst: typing.Union[float, None] = None
+    error: typing.Union[BaseException, None] = None
+    done: bool = False
+
 
-        aq = asyncio.Queue()
+# connect_all tasks still running after it returned.
+_connecting = set()
 
-        self.outstanding_replies[msgid] = aq
-        self.writer.write(f"{msgid} set {param} {value}\n".encode())
-        await self.writer.drain()
 
-        return await aq.get()
+def _endpoint(endpoint):
+    """(host, port) from a (host, port) pair or a "host:port" or "unix:/path" string."""
+    if transport.unix_path(endpoint) is not None:
+        return endpoint, None
+    if isinstance(endpoint, str):
+        host, _, port = endpoint.rpartition(":")
+        return host, int(port)
+    host, port = endpoint
+    return host, int(port)
+
+
+async def connect_all(endpoints, concurrency=8, deadline=None, required=None, factory=None, **kwargs):
+    """
+    Open a client (a Subscriber unless factory says otherwise,
+    made with factory(host, port, **kwargs)) for every endpoint,
+    (host, port) or "host:port", with at most concurrency opens
+    in progress at a time.
+
+    Returns a dict of (host, port): ConnectReport as soon as every
+    required endpoint (all of them by default) is up or has
+    failed. The rest carry on in the background and fill in their
+    report when done. Anything not up after deadline seconds is
+    given up on with a TimeoutError, so a dead host costs at most
+    deadline.
+    """
+    if factory is None:
+        factory = Subscriber
+    loop = asyncio.get_running_loop()
+    endpoints = list(dict.fromkeys(_endpoint(endpoint) for endpoint in endpoints))
+    required = set(endpoints) if required is None else {_endpoint(endpoint) for endpoint in required}
+    unknown = required.difference(endpoints)
+    if unknown:
+        raise ValueError(f"required endpoints {unknown} are not in endpoints")
+
+    reports = {endpoint: ConnectReport(*endpoint) for endpoint in endpoints}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect(report):
+        client = None
+        try:
+            async with semaphore:
+                client = factory(report.host, report.port, **kwargs)
+                opened = await client.open()
+            report.connect = client.open_timings["connect"]
+            report.lst = client.open_timings["lst"]
+            if opened:
+                report.client = client
+            else:
+                report.error = client.open_error
+        except asyncio.CancelledError:
+            report.error = asyncio.TimeoutError(f"No connection to {report.host}:{report.port} within {deadline} s")
+            if client is not None:
+                await client.close()
+        except Exception as error:
+            report.error = error
+            if client is not None:
+                await client.close()
+        finally:
+            report.done = True
+
+    # Required endpoints get the first turns at the semaphore.
+    tasks = {}
+    for endpoint in sorted(endpoints, key=lambda endpoint: endpoint not in required):
+        task = tasks[endpoint] = loop.create_task(connect(reports[endpoint]))
+        _connecting.add(task)
+        task.add_done_callback(_connecting.discard)
+
+    if deadline is not None:
+        expire = loop.call_later(deadline, lambda: [task.cancel() for task in tasks.values()])
+        for task in tasks.values():
+            task.add_done_callback(lambda task: all(t.done() for t in tasks.values()) and expire.cancel())
+
+    waiting = [tasks[endpoint] for endpoint in required]
+    if waiting:
+        await asyncio.wait(waiting)
+    return reports
 
 
 class SubscriberSingleton:
     """For most uses we probably will only ever need one
     instance of a client per msg server. This will
     instantiate a Subscriber if none exist for
-    that host and port"""
+    that host and port
+
+    Deprecated: kept for existing code, use
+    saomsg.manager.ConnectionManager, which also shares
+    subscriptions and closes connections nobody uses."""
 
     clients = {}
 
     def __new__(cls, host, port):
+        warnings.warn("SubscriberSingleton is deprecated, use saomsg.manager.ConnectionManager", DeprecationWarning, 2)
         if (host, port) not in cls.clients:
             cls.clients[(host, port)] = Subscriber(host, port)
 
@@ -0,0 +1,253 @@
+import asyncio
+import functools
+from dataclasses import dataclass, field
+
+from .client import Subscriber, Subscription, clogger
+
+
+@dataclass
+class _Server:
+    """A shared connection and who is using it."""
+
+    client: Subscriber
+    opening: asyncio.Task
+    leases: set = field(default_factory=set)
+    # param: {lease: Subscription of its callback, or None} for
+    # every param subscribed on the wire.
+    params: dict = field(default_factory=dict)
+    close_handle: asyncio.TimerHandle = None
+
+
+class Lease:
+    """
+    One consumer's use of a connection shared through a
+    ConnectionManager. Subscriptions made through the lease are
+    merged with those of the other leases on the same server and
+    are dropped by release(). Anything else (get, set, run, ...)
+    is passed straight to the shared Subscriber, self.client.
+
+    Also an async context manager that releases on exit.
+    """
+
+    def __init__(self, manager, key, server):
+        self._manager = manager
+        self._key = key
+        self._server = server
+        self.client = server.client
+        self.params = set()
+        self.released = False
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def subscribe(self, param, callback=None, conflate=False, max_pending=100, **kwargs):
+        """
+        Subscribe to param, see Subscriber.subscribe. Only the first
+        lease to subscribe to a param puts a sub on the wire and its
+        kwargs (min_interval, period) are the ones used, later
+        leases share that subscription and are handed the current
+        value straight away if there is one. Returns a future that
+        resolves to the initial value.
+
+        Each lease's callback is called as Subscriber.subscribe
+        calls it, with its own conflate and max_pending. Callbacks
+        run on the event loop, executor is not supported.
+        """
+        if self.released:
+            raise RuntimeError("Lease has been released")
+        if "executor" in kwargs or "on_result" in kwargs:
+            raise ValueError("Lease callbacks run on the event loop, executor and on_result are not supported")
+
+        server = self._server
+        callbacks = server.params.setdefault(param, {})
+        delivery = None
+        if callback is not None:
+            delivery = Subscription(param, callback, conflate=conflate, max_pending=max_pending)
+        old = callbacks.get(self)
+        if old is not None:
+            self.client._drop_values(old)
+
+        if param not in self.client.subscriptions:
+            # The first to ask, or the server refused an earlier sub.
+            callbacks[self] = delivery
+            self.params.add(param)
+            try:
+                return self.client.subscribe(param, functools.partial(self._manager._fanout, server, param), **kwargs)
+            except Exception:
+                del callbacks[self]
+                self.params.discard(param)
+                if not callbacks:
+                    del server.params[param]
+                raise
+
+        if kwargs:
+            clogger.debug(f"{param} is already subscribed, ignoring {kwargs}")
+        callbacks[self] = delivery
+        self.params.add(param)
+        cached = self.client.cached(param)
+        if cached is not None and delivery is not None:
+            self.client._deliver(delivery, list(cached[0]))
+        return self.client.subscriptions[param].ready
+
+    def unsubscribe(self, param):
+        """Stop this lease's subscription to param."""
+        if param not in self.params:
+            return
+        self.params.discard(param)
+        callbacks = self._server.params[param]
+        delivery = callbacks.pop(self)
+        if delivery is not None:
+            self.client._drop_values(delivery)
+        if not callbacks:
+            del self._server.params[param]
+            self.client.unsubscribe(param)
+
+    def release(self):
+        """Drop this lease's subscriptions and its hold on the connection."""
+        if self.released:
+            return
+        for param in list(self.params):
+            self.unsubscribe(param)
+        self.released = True
+        self._manager._release(self._key, self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class ConnectionManager:
+    """
+    Share one Subscriber per MSG server among any number of
+    consumers, each holding a Lease from acquire():
+
+        async with await manager.acquire("fields", 10100) as pmac:
+            pmac.subscribe("filter1Pos", show)
+            await pmac.run("filter1Wheel", 3)
+
+    A param is subscribed to once however many leases want it and
+    unsubscribed when the last of them lets go. A connection with
+    no leases left is closed after idle_grace seconds unless it is
+    acquired again in the meantime.
+
+    The Subscribers reconnect by default, keeping the leases and
+    their subscriptions alive through a dropped connection. One
+    that has stopped for good is replaced by the next acquire().
+
+    The manager belongs to the event loop it is first used on and,
+    like the rest of asyncio, must only be used from that loop's
+    thread; use asyncio.run_coroutine_threadsafe from others.
+    kwargs are passed on to every Subscriber.
+    """
+
+    IDLE_GRACE = 30.0
+
+    def __init__(self, idle_grace=None, **kwargs):
+        self.idle_grace = self.IDLE_GRACE if idle_grace is None else idle_grace
+        kwargs.setdefault("reconnect", True)
+        self.kwargs = kwargs
+        self.servers = {}
+        self._loop = None
+        self._closing = set()
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        elif loop is not self._loop:
+            raise RuntimeError("ConnectionManager used from a different event loop")
+        return loop
+
+    async def acquire(self, host, port):
+        """
+        Return a Lease on the connection to host:port, opening it
+        if need be. Raises ConnectionError if it can't be opened.
+        """
+        loop = self._check_loop()
+        key = (host, port)
+        server = self.servers.get(key)
+        if server is not None and self._stopped(server):
+            clogger.info(f"Replacing the stopped connection to {host}:{port}")
+            del self.servers[key]
+            self._close_later(server)
+            server = None
+        if server is None:
+            client = Subscriber(host, port, **self.kwargs)
+            server = self.servers[key] = _Server(client, loop.create_task(client.open()))
+
+        # Hold the connection while it opens so it isn't closed under us.
+        lease = Lease(self, key, server)
+        server.leases.add(lease)
+        if server.close_handle is not None:
+            server.close_handle.cancel()
+            server.close_handle = None
+
+        try:
+            opened = await asyncio.shield(server.opening)
+        except BaseException:
+            lease.release()
+            raise
+        if not opened:
+            lease.release()
+            if self.servers.get(key) is server:
+                del self.servers[key]
+            raise ConnectionError(f"Could not open {host}:{port}: {server.client.open_error}")
+        return lease
+
+    @staticmethod
+    def _stopped(server):
+        """True if server's client failed to open or has stopped since."""
+        opening = server.opening
+        if not opening.done():
+            return False
+        return opening.cancelled() or opening.exception() is not None or server.client._closed()
+
+    def _release(self, key, lease):
+        server = self.servers.get(key)
+        if server is None or lease not in server.leases:
+            return
+        server.leases.discard(lease)
+        if not server.leases:
+            server.close_handle = self._loop.call_later(self.idle_grace, self._close_idle, key, server)
+
+    def _close_idle(self, key, server):
+        if self.servers.get(key) is server and not server.leases:
+            clogger.debug(f"Closing idle connection to {key[0]}:{key[1]}")
+            del self.servers[key]
+            self._close_later(server)
+
+    def _close_later(self, server):
+        task = self._loop.create_task(self._close(server))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, server):
+        if server.close_handle is not None:
+            server.close_handle.cancel()
+        if not server.opening.done():
+            server.opening.cancel()
+        await server.client.stop()
+        await server.client.close()
+
+    async def close(self):
+        """Close every connection, leases and all."""
+        servers = list(self.servers.values())
+        self.servers.clear()
+        await asyncio.gather(*(self._close(server) for server in servers), *self._closing)
+
+    @staticmethod
+    def _fanout(server, param, value):
+        """
+        The callback of a merged subscription. Hands value to every
+        lease's callback through the Subscriber's own delivery, so
+        they get its calling convention, task limits and backlog.
+        """
+        for delivery in list(server.params.get(param, {}).values()):
+            if delivery is not None:
+                server.client._deliver(delivery, list(value))
+
+    def stats(self):
+        """Return (host, port): number of leases and of params subscribed."""
+        return {key: dict(leases=len(server.leases), params=len(server.params)) for key, server in self.servers.items()}
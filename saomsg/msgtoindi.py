@@ -6,6 +6,7 @@ import functools
 import os
 from pathlib import Path
 import datetime
+import math
 import time
 
 
@@ -222,10 +223,18 @@ class msg_device(device):
         while self.running:
             msg_name = await self.msgget_que.get()
 
-            value = await self.msg_client.get(msg_name)
+            # Params we subscribe to are kept current by their
+            # posts, only go to the server for the rest.
             vec = self.IUFind(msg_name)
             button = self.IUFind(f"{msg_name}_getorsub")
             button[f"get_{msg_name}"].value = "Off"
+            try:
+                value = await self.msg_client.get(msg_name, max_age=math.inf)
+            except asyncio.TimeoutError:
+                self.IDMessage(f"No reply to get {msg_name} from the msg server")
+                button.state = "Alert"
+                self.IDSet(button)
+                continue
             if button.state != "Ok":
                 button.state = "Idle"
 
@@ -0,0 +1,287 @@
+"""
+A MSG relay: one upstream connection to a MSG server shared by
+any number of local clients.
+
+    python -m saomsg.relay fields:10100 --listen localhost:10200
+
+Clients talk MSG to the relay as they would to the server. Every
+param subscribed to by any client is subscribed to once upstream
+and each client's posts are throttled to its own update interval
+from there. gets of subscribed params are answered from the
+relay's cache once a value is in, anything else is passed
+upstream except block gets, which are refused. The load on the
+server is the same however many clients connect.
+"""
+import argparse
+import asyncio
+import math
+
+from . import transport
+from .client import ACK, CMD, SET, Subscriber, clogger, parse_msg
+
+
+class _Feed:
+    """Posts of one param to one client, no more often than update."""
+
+    def __init__(self, relay, conn, param, update):
+        self.relay = relay
+        self.conn = conn
+        self.param = param
+        self.update = update
+        self.last = -math.inf
+        self.handle = None
+        if update < 0:
+            self.handle = asyncio.get_running_loop().call_later(-update, self._periodic)
+
+    def offer(self, now):
+        """A new value is in, post it now or when the interval is up."""
+        if self.update < 0 or self.handle is not None:
+            return
+        wait = self.last + self.update - now
+        if wait <= 0:
+            self.post(now)
+        else:
+            self.handle = asyncio.get_running_loop().call_at(now + wait, self._delayed)
+
+    def post(self, now):
+        self.last = now
+        self.conn.write(f"0 set {self.param} {self.relay.value(self.param)}\n")
+
+    def _delayed(self):
+        self.handle = None
+        self.post(asyncio.get_running_loop().time())
+
+    def _periodic(self):
+        loop = asyncio.get_running_loop()
+        self.post(loop.time())
+        self.handle = loop.call_later(-self.update, self._periodic)
+
+    def cancel(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+
+class _Client:
+    """A downstream connection."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")
+        self.feeds = {}
+        self.tasks = set()
+
+    def write(self, text):
+        if not self.writer.is_closing():
+            self.writer.write(text.encode())
+
+    def reply(self, msgid, reply):
+        """Send the ack (a list of args or a string) or nak (an exception) for msgid."""
+        if msgid == 0:
+            return
+        if isinstance(reply, BaseException):
+            line = f"{msgid} nak {reply}"
+        elif isinstance(reply, list):
+            line = f"{msgid} ack {' '.join(reply)}"
+        else:
+            line = f"{msgid} ack {reply}"
+        self.write(line.rstrip() + "\n")
+
+
+class Relay:
+    """
+    Relay the MSG server at host:port to clients connecting to
+    listen_host:listen_port. Either host may be "unix:/path" for
+    a Unix domain socket. listen_options are socket options for
+    the client connections (see transport.set_options). kwargs go
+    to the upstream Subscriber, which always reconnects and merges
+    concurrent gets.
+    """
+
+    def __init__(self, host, port, listen_host="localhost", listen_port=6869, listen_options=None, **kwargs):
+        kwargs.setdefault("reconnect", True)
+        kwargs.setdefault("single_flight", True)
+        self.upstream = Subscriber(host, port, **kwargs)
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.listen_options = dict(listen_options or {})
+        self.server = None
+        self.clients = set()
+        # param: {client: _Feed}
+        self.feeds = {}
+
+    async def start(self):
+        """Connect upstream and start listening."""
+        if not await self.upstream.open():
+            raise ConnectionError(f"Could not open {self.upstream.host}:{self.upstream.port}: {self.upstream.open_error}")
+        self.server = await transport.start_server(self._serve, self.listen_host, self.listen_port, **self.listen_options)
+        clogger.info(f"Relaying {self.upstream.host}:{self.upstream.port} on {self.listen_host}:{self.listen_port}")
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for client in list(self.clients):
+            client.writer.close()
+            for task in client.tasks:
+                task.cancel()
+        if self.server is not None:
+            await self.server.wait_closed()
+        await self.upstream.stop()
+        await self.upstream.close()
+
+    def value(self, param):
+        return self.upstream.server_info["subscribed"].get(param) or ""
+
+    def stats(self):
+        """Number of clients and of params subscribed upstream."""
+        return dict(clients=len(self.clients), params=len(self.feeds))
+
+    async def _serve(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        try:
+            while line := await reader.readline():
+                msg = parse_msg(line)
+                if msg is not None:
+                    self._dispatch(client, msg)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            for param in list(client.feeds):
+                self._unsubscribe(client, param)
+            writer.close()
+
+    def _dispatch(self, client, msg):
+        # A line without a msgid is a request that wants no reply.
+        msgid = msg.msgid or 0
+        match msg:
+            case SET(_, param):
+                self._send(client, msgid, f"set {param}", f"set {param} {msg.text}".rstrip())
+            case ACK(_, args):
+                client.reply(msgid, args)
+            case CMD(_, "lst"):
+                self._list(client, msgid)
+            case CMD(_, "sub"):
+                self._subscribe(client, msgid, msg.args)
+            case CMD(_, "uns", args):
+                for param in args[:1]:
+                    self._unsubscribe(client, param)
+                client.reply(msgid, "")
+            case CMD(_, "get", [param]) if param in self.upstream.subscriptions and self.upstream.cached(param) is not None:
+                client.reply(msgid, self.value(param))
+            case CMD(_, "get", [param, length]):
+                # The upstream connection is shared, it can't be
+                # handed a block nobody there asked for.
+                client.reply(msgid, RuntimeError(f"block gets are not relayed: get {param} {length}"))
+            case CMD(_, verb, args):
+                # gets and commands go upstream.
+                key = f"get {args[0]}" if verb == "get" and args else verb
+                self._send(client, msgid, key, f"{verb} {msg.raw.decode().strip()}".strip())
+
+    def _send(self, client, msgid, key, request):
+        task = asyncio.get_running_loop().create_task(self._forward(client, msgid, key, request))
+        client.tasks.add(task)
+        task.add_done_callback(client.tasks.discard)
+
+    async def _forward(self, client, msgid, key, request):
+        try:
+            reply = await self.upstream._timed_request(key, request)
+        except (ConnectionError, asyncio.TimeoutError) as error:
+            reply = error
+        client.reply(msgid, reply)
+
+    def _list(self, client, msgid):
+        catalog = self.upstream.catalog
+        lines = [f"{msgid} ack\n", f"server\t{catalog.server}\t{catalog.server_comment}\n"]
+        lines.extend(f"{entry.kind}\t{entry.name}\t{entry.comment}\n" for entry in catalog)
+        lines.append("----LIST----\n")
+        client.write("".join(lines))
+
+    def _subscribe(self, client, msgid, args):
+        if not args:
+            client.reply(msgid, RuntimeError("sub needs a name"))
+            return
+        param = args[0]
+        try:
+            update = float(args[1]) if len(args) > 1 else 1.0
+        except ValueError:
+            client.reply(msgid, RuntimeError(f"bad update {args[1]}"))
+            return
+        if param not in self.upstream.server_info["published"]:
+            client.reply(msgid, RuntimeError(f"No variable {param}"))
+            return
+
+        feeds = self.feeds.get(param)
+        if feeds is None:
+            feeds = self.feeds[param] = {}
+            ready = self.upstream.subscribe(param, lambda value, param=param: self._posted(param), min_interval=0)
+        else:
+            ready = self.upstream.subscriptions[param].ready
+
+        old = feeds.pop(client, None)
+        if old is not None:
+            old.cancel()
+        feed = feeds[client] = client.feeds[param] = _Feed(self, client, param, update)
+
+        def subscribed(fut):
+            # As msg_ssub does: ack with the value, then post it.
+            if fut.cancelled():
+                reply = ConnectionError("Upstream sub was cancelled")
+            else:
+                reply = fut.exception() or fut.result()
+            if isinstance(reply, BaseException):
+                client.reply(msgid, reply)
+                self._unsubscribe(client, param)
+                return
+            client.reply(msgid, self.value(param))
+            feed.post(asyncio.get_running_loop().time())
+
+        if ready.done():
+            subscribed(ready)
+        else:
+            ready.add_done_callback(subscribed)
+
+    def _unsubscribe(self, client, param):
+        feed = client.feeds.pop(param, None)
+        if feed is None:
+            return
+        feed.cancel()
+        feeds = self.feeds.get(param)
+        if feeds is not None and feeds.get(client) is feed:
+            del feeds[client]
+            if not feeds:
+                del self.feeds[param]
+                self.upstream.unsubscribe(param)
+
+    def _posted(self, param):
+        now = asyncio.get_running_loop().time()
+        for feed in list(self.feeds.get(param, {}).values()):
+            feed.offer(now)
+
+
+def _endpoint(text):
+    if transport.unix_path(text) is not None:
+        return text, None
+    host, _, port = text.rpartition(":")
+    return host or "localhost", int(port)
+
+
+async def main(upstream, listen):
+    relay = Relay(*upstream, *listen)
+    await relay.start()
+    try:
+        await relay.serve_forever()
+    finally:
+        await relay.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relay a MSG server to many local clients")
+    parser.add_argument("upstream", help="host:port or unix:/path of the MSG server")
+    parser.add_argument("--listen", default="localhost:6869", help="host:port or unix:/path to listen on")
+    args = parser.parse_args()
+    asyncio.run(main(_endpoint(args.upstream), _endpoint(args.listen)))
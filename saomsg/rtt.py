@@ -0,0 +1,164 @@
+import json
+import logging
+import math
+import os
+
+rlogger = logging.getLogger("msg-client-logger")
+
+
+class RTTEstimator:
+    """
+    Smoothed round trip time and round trip time variation of a
+    stream of samples, kept the way TCP does (RFC 6298):
+
+        rttvar = (1 - BETA) * rttvar + BETA * |srtt - rtt|
+        srtt = (1 - ALPHA) * srtt + ALPHA * rtt
+
+    All times are in seconds.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    # rto() allows for K times the variation on top of srtt.
+    K = 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.last = None
+        self.min = math.inf
+        self.max = 0.0
+        self.samples = 0
+
+    def update(self, rtt):
+        """Add the round trip time rtt."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+        self.last = rtt
+        self.min = min(self.min, rtt)
+        self.max = max(self.max, rtt)
+        self.samples += 1
+
+    def rto(self, initial, floor=0.0, ceiling=math.inf):
+        """
+        Return how long to wait for a reply before giving up:
+        srtt + K * rttvar clamped to [floor, ceiling], or initial
+        if there are no samples yet.
+        """
+        if self.srtt is None:
+            return initial
+        return min(max(self.srtt + self.K * self.rttvar, floor), ceiling)
+
+    @classmethod
+    def from_stats(cls, stats):
+        """Make an estimator that carries on from the output of stats()."""
+        est = cls()
+        est.srtt = stats["srtt"]
+        est.rttvar = stats["rttvar"]
+        est.last = stats["last"]
+        est.samples = stats["samples"]
+        if est.samples:
+            est.min = stats["min"]
+            est.max = stats["max"]
+        return est
+
+    def stats(self):
+        """Return the estimate and the sample statistics as a dict."""
+        return dict(
+            srtt=self.srtt,
+            rttvar=self.rttvar,
+            last=self.last,
+            min=self.min if self.samples else None,
+            max=self.max if self.samples else None,
+            samples=self.samples,
+        )
+
+
+class AdaptiveTimeouts:
+    """
+    Timeouts for MSG requests learned from how long earlier
+    requests with the same key took. Keys are whatever the caller
+    wants to tell apart, Subscriber uses "get <param>",
+    "set <param>" and the command name for run.
+
+    A key with no history gets INITIAL, otherwise the RTO of its
+    RTTEstimator clamped to [FLOOR, CEILING]. Every timeout doubles
+    the key's timeout (up to CEILING) until a reply comes back in
+    time, as TCP backs off its RTO.
+
+    The default FLOOR is generous: msg.tcl servers handle one
+    request at a time, so a get that is normally answered in a
+    millisecond can sit behind a command that takes many seconds.
+    Pass a lower floor to give up on fast requests sooner.
+
+    If path is given, the estimates are loaded from that JSON
+    file and save() writes them back. Latencies are a property of
+    the server, so use one file per server.
+    """
+
+    INITIAL = 60.0
+    FLOOR = 30.0
+    CEILING = 600.0
+
+    def __init__(self, path=None, initial=None, floor=None, ceiling=None):
+        self.path = path
+        self.initial = self.INITIAL if initial is None else initial
+        self.floor = self.FLOOR if floor is None else floor
+        self.ceiling = self.CEILING if ceiling is None else ceiling
+        self.estimators = {}
+        self._backoff = {}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def timeout(self, key):
+        """Return the timeout in seconds for a request with key."""
+        est = self.estimators.get(key)
+        if est is None:
+            timeout = self.initial
+        else:
+            timeout = est.rto(self.initial, self.floor, self.ceiling)
+        return min(timeout * self._backoff.get(key, 1), self.ceiling)
+
+    def observe(self, key, elapsed):
+        """Record that a request with key was answered after elapsed seconds."""
+        est = self.estimators.get(key)
+        if est is None:
+            est = self.estimators[key] = RTTEstimator()
+        est.update(elapsed)
+        self._backoff.pop(key, None)
+
+    def expired(self, key):
+        """Record that a request with key timed out."""
+        self._backoff[key] = 2 * self._backoff.get(key, 1)
+
+    def stats(self):
+        """Return key: RTTEstimator.stats() plus the current timeout."""
+        stats = {}
+        for key, est in self.estimators.items():
+            stats[key] = est.stats()
+            stats[key]["timeout"] = self.timeout(key)
+        return stats
+
+    def load(self, path):
+        """Read estimates saved by save(), a bad file is ignored."""
+        try:
+            with open(path) as fd:
+                saved = json.load(fd)
+            self.estimators = {key: RTTEstimator.from_stats(stats) for key, stats in saved.items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+            rlogger.warning(f"Ignoring timeouts in {path}: {error}")
+
+    def save(self, path=None):
+        """Write the estimates to path, self.path by default."""
+        path = self.path if path is None else path
+        if path is None:
+            return
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as fd:
+            json.dump({key: est.stats() for key, est in self.estimators.items()}, fd, indent=1)
+        os.replace(tmp, path)
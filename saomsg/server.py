@@ -0,0 +1,439 @@
+"""
+A MSG server, the server side of the protocol as msg_server in
+scripts/msg.tcl implements it:
+
+    server = MSGServer("TESTSRV", port=6868)
+    server.publish("foo", "1.0", "The foo value")
+
+    @server.register("multiply")
+    async def multiply(x, y):
+        server.set("foo", float(x) * float(y))
+
+    await server.start()
+    await server.serve_forever()
+
+Clients can lst, get, set, sub and uns the published values and
+run the registered commands. Each subscriber gets posts at its
+own update interval: a positive update posts changes, but no
+more often than that many seconds, 0 posts every set and a
+negative update posts the value every -update seconds whether
+it changed or not.
+
+Subscribers are indexed by param and by connection, so a set
+only visits the subscribers of that param and a disconnect only
+those of that connection. The post line is encoded once per
+value and whatever a connection is sent in one pass of the
+event loop goes out in a single write.
+"""
+import argparse
+import asyncio
+import fnmatch
+import inspect
+import math
+
+from . import transport
+from .client import ACK, CMD, SET, clogger, parse_msg
+
+
+def _text(value):
+    """A value as it goes on the wire, lists and tuples space separated."""
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+
+def match_host(host, pattern):
+    """
+    True if host matches pattern, compared label by label from
+    the right as msg_matchone does, so "mmto.org" matches every
+    host in that domain. Labels may use shell wildcards.
+    """
+    labels = host.lower().split(".")
+    pattern = pattern.lower().split(".")
+    if len(pattern) > len(labels):
+        return False
+    return all(fnmatch.fnmatchcase(label, pat) for label, pat in zip(reversed(labels), reversed(pattern)))
+
+
+def check_host(names, allow=(), deny=()):
+    """
+    True if a peer known by names (address, hostname, ...) may
+    connect: it matches a pattern in allow, or none in deny.
+    """
+    for pattern in allow:
+        if any(match_host(name, pattern) for name in names):
+            return True
+    for pattern in deny:
+        if any(match_host(name, pattern) for name in names):
+            return False
+    return True
+
+
+class _Published:
+    """A published value and who is subscribed to it."""
+
+    __slots__ = ("name", "value", "comment", "subs", "_line")
+
+    def __init__(self, name, value, comment):
+        self.name = name
+        self.value = value
+        self.comment = comment
+        # connection: _Sub
+        self.subs = {}
+        self._line = None
+
+    @property
+    def line(self):
+        """The post of the current value, encoded once."""
+        if self._line is None:
+            self._line = f"0 set {self.name} {self.value}\n".encode()
+        return self._line
+
+
+class _Sub:
+    """One connection's subscription to one published value."""
+
+    __slots__ = ("conn", "pub", "update", "last", "handle")
+
+    def __init__(self, conn, pub, update):
+        self.conn = conn
+        self.pub = pub
+        self.update = update
+        self.last = -math.inf
+        self.handle = None
+        if update < 0:
+            self.handle = asyncio.get_running_loop().call_later(-update, self._periodic)
+
+    def changed(self, now):
+        """The value changed, post it now or when the interval is up."""
+        if self.handle is not None:
+            return
+        wait = self.last + self.update - now
+        if wait <= 0:
+            self.post(now)
+        else:
+            self.handle = asyncio.get_running_loop().call_at(now + wait, self._delayed)
+
+    def post(self, now):
+        self.last = now
+        self.conn.write(self.pub.line)
+
+    def _delayed(self):
+        self.handle = None
+        self.post(asyncio.get_running_loop().time())
+
+    def _periodic(self):
+        loop = asyncio.get_running_loop()
+        self.post(loop.time())
+        self.handle = loop.call_later(-self.update, self._periodic)
+
+    def cancel(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+
+class _Connection:
+    """A client connection and its write batch."""
+
+    def __init__(self, server, writer):
+        self.server = server
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")
+        # param: _Sub
+        self.subs = {}
+        self.tasks = set()
+        self._batch = []
+
+    def write(self, data):
+        """Queue data, the batch is written once the loop comes round."""
+        if self.writer.is_closing():
+            return
+        if not self._batch:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._batch.append(data)
+
+    def _flush(self):
+        batch, self._batch = self._batch, []
+        if self.writer.is_closing():
+            return
+        self.writer.write(b"".join(batch))
+        if self.writer.transport.get_write_buffer_size() > self.server.max_buffer:
+            clogger.warning(f"Dropping {self.peer}, it is not reading what it is sent")
+            self.writer.transport.abort()
+
+    def reply(self, msgid, reply):
+        """Send the ack (None, a value or a list) or nak (an exception) for msgid."""
+        if not msgid:
+            return
+        if isinstance(reply, BaseException):
+            line = f"{msgid} nak {reply}"
+        elif reply is None:
+            line = f"{msgid} ack"
+        else:
+            line = f"{msgid} ack {_text(reply)}"
+        self.write(line.rstrip().encode() + b"\n")
+
+
+class MSGServer:
+    """
+    Serve published values and registered commands to MSG
+    clients on host:port (all interfaces if host is None, or a
+    "unix:/path" socket). comment is sent with the server name in
+    lst replies, host:port by default.
+
+    allow and deny are host patterns (see match_host) checked
+    against the address and name of every new client: a client
+    matching allow is let in, one matching deny is turned away,
+    anyone else is let in. socket_options are applied to the
+    client connections (see transport.set_options).
+
+    A client that falls more than max_buffer bytes behind on its
+    posts is disconnected.
+    """
+
+    MAX_BUFFER = 4 * 1024 * 1024
+
+    def __init__(self, name, host=None, port=6868, comment=None, allow=(), deny=(), socket_options=None, max_buffer=None):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.comment = f"{host or ''}:{port}" if comment is None else comment
+        self.allow = list(allow)
+        self.deny = list(deny)
+        self.socket_options = dict(socket_options or {})
+        self.max_buffer = self.MAX_BUFFER if max_buffer is None else max_buffer
+        self.published = {}
+        # name: (handler, comment)
+        self.registered = {}
+        self.connections = set()
+        self.server = None
+
+    def publish(self, name, value="", comment=""):
+        """Publish name with an initial value."""
+        if name in self.published:
+            self.published[name].comment = comment
+            self.set(name, value)
+        else:
+            self.published[name] = _Published(name, _text(value), comment)
+
+    def register(self, name, handler=None, comment=""):
+        """
+        Register handler as the command name. The handler is called
+        with the command's arguments as strings and may be a plain
+        function, run before the next request is read, or a
+        coroutine function, run as a task. What it returns is sent
+        back in the ack, if it raises the client gets a nak with
+        the error. Used without a handler it is a decorator.
+        """
+        if handler is None:
+            return lambda handler: self.register(name, handler, comment)
+        self.registered[name] = (handler, comment)
+        return handler
+
+    def get(self, name):
+        """Return the value of the published name."""
+        return self.published[name].value
+
+    def set(self, name, value, setter=None):
+        """
+        Set the published name to value and post it to the
+        subscribers, except setter, the connection the set came
+        from. Subscribers with a positive update are only posted
+        changes.
+        """
+        pub = self.published[name]
+        value = _text(value)
+        changed = value != pub.value
+        if changed:
+            pub.value = value
+            pub._line = None
+
+        now = asyncio.get_running_loop().time() if pub.subs else 0
+        for sub in pub.subs.values():
+            if sub.conn is setter:
+                sub.last = now
+            elif sub.update == 0:
+                sub.post(now)
+            elif sub.update > 0 and changed:
+                sub.changed(now)
+
+    async def start(self):
+        """Start listening."""
+        self.server = await transport.start_server(self._serve, self.host, self.port, **self.socket_options)
+        clogger.info(f"Serving {self.name} on {self.host or '*'}:{self.port}")
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for conn in list(self.connections):
+            conn.writer.close()
+            for task in conn.tasks:
+                task.cancel()
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    def stats(self):
+        """Number of clients and of subscriptions."""
+        return dict(clients=len(self.connections), subscriptions=sum(len(conn.subs) for conn in self.connections))
+
+    async def _permitted(self, writer):
+        if not (self.allow or self.deny):
+            return True
+        peer = writer.get_extra_info("peername")
+        if not isinstance(peer, tuple):
+            # A Unix socket, the peer is on this machine.
+            return True
+        names = [peer[0]]
+        try:
+            hostname, _ = await asyncio.get_running_loop().getnameinfo(peer[:2])
+            names.append(hostname)
+        except OSError:
+            pass
+        return check_host(names, self.allow, self.deny)
+
+    async def _serve(self, reader, writer):
+        if not await self._permitted(writer):
+            clogger.warning(f"Refusing {writer.get_extra_info('peername')}, permission denied")
+            writer.close()
+            return
+
+        conn = _Connection(self, writer)
+        self.connections.add(conn)
+        try:
+            while line := await reader.readline():
+                msg = parse_msg(line)
+                if msg is not None:
+                    self._dispatch(conn, msg)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(conn)
+            for param in list(conn.subs):
+                self._unsubscribe(conn, param)
+            for task in conn.tasks:
+                task.cancel()
+            writer.close()
+
+    def _dispatch(self, conn, msg):
+        # A line without a msgid is a request that wants no reply.
+        msgid = msg.msgid or 0
+        match msg:
+            case SET(_, param):
+                if param in self.published:
+                    self.set(param, msg.text, setter=conn)
+                    conn.reply(msgid, None)
+                else:
+                    conn.reply(msgid, RuntimeError(f"cannot access {param}"))
+            case ACK(_, args):
+                conn.reply(msgid, args)
+            case CMD(_, "lst"):
+                self._list(conn, msgid)
+            case CMD(_, "get", args):
+                pub = self.published.get(args[0]) if args else None
+                if pub is None:
+                    conn.reply(msgid, RuntimeError(f"No variable {' '.join(args[:1])}"))
+                else:
+                    conn.reply(msgid, pub.value)
+            case CMD(_, "sub", args):
+                self._subscribe(conn, msgid, args)
+            case CMD(_, "uns", args):
+                for param in args[:1]:
+                    self._unsubscribe(conn, param)
+                conn.reply(msgid, None)
+            case CMD(_, verb, args) if verb in self.registered:
+                self._run(conn, msgid, verb, args)
+            case CMD(_, verb):
+                conn.reply(msgid, RuntimeError(f'invalid command name "{verb}"'))
+
+    def _run(self, conn, msgid, verb, args):
+        # Plain handlers run in line, so requests that follow see
+        # their effects as with msg.tcl, coroutines run as tasks.
+        handler, _ = self.registered[verb]
+        try:
+            reply = handler(*args)
+        except Exception as error:
+            reply = error
+        if inspect.isawaitable(reply):
+            task = asyncio.get_running_loop().create_task(self._finish(conn, msgid, verb, args, reply))
+            conn.tasks.add(task)
+            task.add_done_callback(conn.tasks.discard)
+            return
+        self._reply(conn, msgid, verb, args, reply)
+
+    async def _finish(self, conn, msgid, verb, args, awaitable):
+        try:
+            reply = await awaitable
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            reply = error
+        self._reply(conn, msgid, verb, args, reply)
+
+    def _reply(self, conn, msgid, verb, args, reply):
+        if isinstance(reply, Exception):
+            clogger.debug(f"{verb} {' '.join(args)} failed: {reply}")
+        conn.reply(msgid, reply)
+
+    def _list(self, conn, msgid):
+        lines = [f"{msgid} ack\n", f"server\t{self.name}\t{self.comment}\n"]
+        lines.extend(f"published\t{pub.name}\t{pub.comment}\n" for pub in self.published.values())
+        lines.extend(f"registered\t{name}\t{comment}\n" for name, (_, comment) in self.registered.items())
+        lines.append("----LIST----\n")
+        conn.write("".join(lines).encode())
+
+    def _subscribe(self, conn, msgid, args):
+        pub = self.published.get(args[0]) if args else None
+        if pub is None:
+            conn.reply(msgid, RuntimeError(f"No variable {' '.join(args[:1])}"))
+            return
+        try:
+            update = float(args[1]) if len(args) > 1 else 1.0
+        except ValueError:
+            conn.reply(msgid, RuntimeError(f"bad update {args[1]}"))
+            return
+
+        self._unsubscribe(conn, pub.name)
+        sub = pub.subs[conn] = conn.subs[pub.name] = _Sub(conn, pub, update)
+        # As msg_ssub does: ack with the value, then post it.
+        conn.reply(msgid, pub.value)
+        sub.post(asyncio.get_running_loop().time())
+
+    def _unsubscribe(self, conn, param):
+        sub = conn.subs.pop(param, None)
+        if sub is None:
+            return
+        sub.cancel()
+        sub.pub.subs.pop(conn, None)
+
+
+async def main(name, port):
+    """Serve the values and commands of scripts/msg_test.tcl."""
+    server = MSGServer(name, port=port)
+    server.publish("foo", "1.0")
+    server.publish("bar", "baz")
+    server.publish("fizz", "")
+    server.publish("bazz", "there once was a man")
+
+    @server.register("multiply")
+    def multiply(x, y):
+        server.set("foo", f"{float(x) * float(y):g}")
+
+    server.register("blurb", lambda: None)
+
+    await server.start()
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a test MSG server like scripts/msg_test.tcl")
+    parser.add_argument("--name", default="TESTSRV")
+    parser.add_argument("--port", type=int, default=6868)
+    args = parser.parse_args()
+    asyncio.run(main(args.name, args.port))
@@ -1,6 +1,37 @@
+import asyncio
+
 import pytest
 
-from saomsg.client import MSGClient
+from saomsg.catalog import Catalog, CatalogCache, Entry
+from saomsg.client import MSGClient, SET, ACK, NAK, CMD, parse_msg, msg_factory
+from saomsg.tests.test_subscriber import StandIn
+
+
+def test_parse_msg():
+    msg = parse_msg(b"0 set foo 20.0 1\r")
+    assert type(msg) is SET
+    assert (msg.msgid, msg.param, msg.text, msg.value) == (0, "foo", "20.0 1", ["20.0", "1"])
+
+    match parse_msg(b"12 ack there  once was"):
+        case ACK(12, args):
+            assert args == ["there", "once", "was"]
+        case _:
+            assert False
+
+    nak = msg_factory("3 nak No variable   oof\n")
+    assert type(nak) is NAK and nak.info == "No variable oof"
+
+    match parse_msg(b"7 multiply 4 5"):
+        case CMD(7, "multiply", ["4", "5"]):
+            pass
+        case _:
+            assert False
+
+    # Messages are slotted, no per-instance __dict__.
+    assert not hasattr(msg, "__dict__")
+
+    assert parse_msg(b"  \r") is None
+    assert msg_factory("set bar\r\n") == SET(None, "bar", b"")
 
 
 @pytest.mark.asyncio
@@ -11,6 +42,60 @@ async def test_client():
     await c.close()
 
 
+@pytest.mark.asyncio
+async def test_catalog():
+    c = MSGClient()
+    await c.open()
+    assert c.catalog.server == c.server_info["name"] == "TESTSRV"
+    assert set(c.server_info["published"]) >= {"foo", "bar", "fizz", "bazz"}
+    assert "multiply" in c.server_info["registered"] and "multiply" not in c.server_info["published"]
+    assert c.catalog.published["bar"] == Entry("bar", "published")
+    assert c.catalog.prefix("ba") == ["bar", "bazz"]
+    assert c.catalog.prefix("mul", "registered") == ["multiply"]
+    with pytest.raises(TypeError):
+        c.server_info["published"]["oof"] = None
+    await c.close()
+
+    catalog = Catalog.from_listing(
+        ["server\tPMAC\tFilter wheels", "published\tfilter1Pos\tPosition in counts", "registered\tfilter1Wheel\t", "junk"]
+    )
+    assert (catalog.server, catalog.server_comment) == ("PMAC", "Filter wheels")
+    assert catalog.comment("filter1Pos") == "Position in counts" and catalog.comment("nope") is None
+    assert len(catalog) == 2 and "filter1Wheel" in catalog
+    assert [entry.kind for entry in catalog] == ["published", "registered"]
+
+
+@pytest.mark.asyncio
+async def test_catalog_cache(tmp_path):
+    cache = CatalogCache(tmp_path / "catalogs.json")
+    c = MSGClient(catalog_cache=cache)
+    await c.open()
+    await c.close()
+    catalog = cache.load("localhost", 6868)
+    assert catalog == c.catalog
+
+    # Make the cached catalog stale.
+    data = catalog.to_dict()
+    data["entries"] = [entry for entry in data["entries"] if entry[0] != "bar"] + [["ghost", "published", ""]]
+    cache.store("localhost", 6868, Catalog.from_dict(data))
+
+    c = MSGClient(catalog_cache=tmp_path / "catalogs.json")
+    diffs = []
+    c.catalog_listeners.append(diffs.append)
+    await c.open()
+    # open() used the cache as is ...
+    published = c.server_info["published"]
+    assert "ghost" in published and "bar" not in published
+    # ... and lst brings it up to date in place.
+    await c._list_task
+    assert "ghost" not in published and "bar" in published
+    assert c.catalog == catalog
+    assert [entry.name for entry in diffs[-1].added] == ["bar"]
+    assert [entry.name for entry in diffs[-1].removed] == ["ghost"]
+    assert c.catalog.prefix("ba") == ["bar", "bazz"]
+    await c.close()
+
+
 @pytest.mark.asyncio
 async def test_get():
     c = MSGClient()
@@ -24,6 +109,17 @@ async def test_get():
     await c.close()
 
 
+@pytest.mark.asyncio
+async def test_pipelined_get():
+    c = MSGClient()
+    await c.open()
+    params = ["bar", "bazz", "fizz"] * 100
+    values = await asyncio.gather(*(c.get(p) for p in params))
+    assert values == ["baz", "there once was a man", ""] * 100
+    assert not c.outstanding_replies
+    await c.close()
+
+
 @pytest.mark.asyncio
 async def test_cmd():
     c = MSGClient()
@@ -87,3 +183,45 @@ async def test_noconnection():
 
     status = await cc.open()
     assert not status
+
+
+@pytest.mark.asyncio
+async def test_request_timeout():
+    # A server that answers lst but nothing else is hung.
+    async with StandIn(published=["foo"], registered=["go"]) as server:
+        c = MSGClient("localhost", server.port)
+        await c.open()
+        assert await c.get("foo", timeout=0.05) is None
+        assert await c.run("go", timeout=0.05) is False
+        assert not c.outstanding_replies
+
+        # Nor when it stops reading, so the request never drains.
+        server.conns[0].transport.pause_reading()
+        start = asyncio.get_running_loop().time()
+        with pytest.raises(asyncio.TimeoutError):
+            await c._request(f"set foo {'x' * 2 ** 24}", 0.5)
+        assert asyncio.get_running_loop().time() - start < 2.0
+        assert not c.outstanding_replies
+        c.writer.transport.abort()
+        await c.close()
+
+
+@pytest.mark.asyncio
+async def test_request_while_reconnecting():
+    def answer(msgid, verb, args):
+        if verb == "get":
+            return f"{msgid} ack 1\n"
+
+    async with StandIn(published=["foo"], answer=answer) as server:
+        c = MSGClient("localhost", server.port, reconnect=True)
+        await c.open()
+        c.writer.transport.abort()
+        while c.running:
+            await asyncio.sleep(0.001)
+
+        # Held until the connection is back rather than refused.
+        assert await asyncio.wait_for(c.get("foo"), 2.0) == "1"
+        assert c.reconnects == 1
+        await c.close()
+        with pytest.raises(ValueError):
+            await c.get("foo")
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from saomsg.catalog import CatalogDiff, Entry
+from saomsg.client import Subscriber, SubscriberSingleton
+from saomsg.manager import ConnectionManager
+from saomsg.tests.test_subscriber import record_writes
+
+
+@pytest.mark.asyncio
+async def test_shared_subscriptions():
+    manager = ConnectionManager(idle_grace=0.1)
+    a, b = await asyncio.gather(manager.acquire("localhost", 6868), manager.acquire("localhost", 6868))
+    client = a.client
+    assert b.client is client and len(manager.servers) == 1
+
+    writes = record_writes(client)
+
+    abar, bbar = [], []
+    assert await a.subscribe("bar", abar.append) == ["baz"]
+    # b shares a's subscription and gets the value it already has.
+    assert await b.subscribe("bar", bbar.append) == ["baz"]
+    await asyncio.sleep(0)
+    assert abar == bbar == [["baz"]]
+    # Coroutine callbacks get the value as Subscriber.subscribe
+    # passes it, and go through its task accounting.
+    bazzes = asyncio.Queue()
+
+    async def took(*value):
+        await bazzes.put(value)
+
+    await a.subscribe("bazz", took)
+    assert await asyncio.wait_for(bazzes.get(), 1.0) == ("there", "once", "was", "a", "man")
+    a.unsubscribe("bazz")
+    with pytest.raises(ValueError):
+        a.subscribe("foo", print, executor="thread")
+    assert "foo" not in client.subscriptions
+    await asyncio.sleep(0.01)
+    assert [r.split(None, 1)[1] for r in writes.lines()] == [b"sub bar", b"sub bazz", b"uns bazz"]
+    assert manager.stats()[("localhost", 6868)] == dict(leases=2, params=1)
+
+    # Leases pass everything else to the client.
+    assert await b.get("bazz") == ["there", "once", "was", "a", "man"]
+
+    a.release()
+    assert "bar" in client.subscriptions
+    async with b:
+        b.unsubscribe("bar")
+        await asyncio.sleep(0.01)
+        assert "bar" not in client.subscriptions and writes.lines()[-1].endswith(b"uns bar")
+
+    # Idle, but picked up again within the grace period.
+    c = await manager.acquire("localhost", 6868)
+    await asyncio.sleep(0.2)
+    assert c.client is client and client.running
+    c.release()
+    await asyncio.sleep(0.2)
+    assert not client.running and manager.servers == {}
+
+    with pytest.raises(ConnectionError):
+        await manager.acquire("localhost", 1)
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_stopped_connections():
+    manager = ConnectionManager(idle_grace=0.1)
+    a = await manager.acquire("localhost", 6868)
+    assert a.client.reconnect
+
+    # A connection that stopped for good is replaced.
+    await a.client.stop()
+    b = await manager.acquire("localhost", 6868)
+    assert b.client is not a.client and b.client.running
+
+    # A sub the server refuses doesn't stop the next lease from
+    # subscribing again.
+    client = b.client
+    client.catalog.apply(CatalogDiff(added=[Entry("nope", "published")]))
+    assert isinstance(await b.subscribe("nope"), RuntimeError)
+    await client._list_task
+    client.catalog.apply(CatalogDiff(added=[Entry("nope", "published")]))
+    c = await manager.acquire("localhost", 6868)
+    assert isinstance(await c.subscribe("nope"), RuntimeError)
+
+    a.release()
+    await manager.close()
+
+
+def test_singleton_shim():
+    with pytest.warns(DeprecationWarning):
+        client = SubscriberSingleton("localhost", 6868)
+    assert type(client) is Subscriber
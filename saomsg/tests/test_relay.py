@@ -0,0 +1,121 @@
+import asyncio
+import socket
+
+import pytest
+
+from saomsg.client import Subscriber
+from saomsg.relay import Relay
+from saomsg.tests.test_subscriber import StandIn
+
+
+@pytest.mark.asyncio
+async def test_relay():
+    relay = Relay("localhost", 6868, listen_port=0)
+    await relay.start()
+    port = relay.server.sockets[0].getsockname()[1]
+
+    a, b = Subscriber("localhost", port), Subscriber("localhost", port)
+    assert await a.open() and await b.open()
+    assert a.server_info["name"] == "TESTSRV" and "multiply" in a.server_info["registered"]
+
+    afoo, bfoo = asyncio.Queue(), asyncio.Queue()
+    await a.subscribe("foo", afoo.put_nowait, min_interval=0)
+    await b.subscribe("foo", bfoo.put_nowait, min_interval=0)
+    assert relay.stats() == dict(clients=2, params=1)
+
+    # Commands go upstream and the posts come back to both.
+    await a.run("multiply", 3, 7)
+    for queue in (afoo, bfoo):
+        while (await asyncio.wait_for(queue.get(), 1.0)) != ["21"]:
+            pass
+
+    # Subscribed gets come from the relay's cache, others go upstream.
+    assert await b.get("foo") == ["21"]
+    assert await b.get("bazz") == ["there", "once", "was", "a", "man"]
+    assert isinstance(await b.get("nope"), RuntimeError)
+
+    # Sets go upstream, acks (heartbeats) are answered by the relay.
+    assert await b.set("fizz", "x", timeout=1.0) == []
+    assert await relay.upstream.get("fizz") == ["x"]
+    await b.set("fizz", "", timeout=1.0)
+    c = Subscriber("localhost", port, heartbeat=0.05)
+    await c.open()
+    await asyncio.sleep(0.2)
+    assert c.rtt_stats()["samples"] >= 2 and c.rtt_stats()["missed"] == 0
+    await c.close()
+
+    b.unsubscribe("foo")
+    await a.close()
+    await b.close()
+    await asyncio.sleep(0.05)
+    assert relay.stats() == dict(clients=0, params=0)
+    assert "foo" not in relay.upstream.subscriptions
+    await relay.close()
+
+
+@pytest.mark.asyncio
+async def test_relay_forwarding():
+    # An upstream that holds back its sub ack, so nothing is
+    # cached for foo yet.
+    sets = []
+
+    def answer(msgid, verb, args):
+        if verb == "get":
+            return f"{msgid} ack 1\n"
+        if verb == "set":
+            sets.append(args)
+            return f"{msgid} ack\n"
+
+    async with StandIn(published=["foo", "bar"], answer=answer) as server:
+        relay = Relay("localhost", server.port, listen_port=0)
+        await relay.start()
+        port = relay.server.sockets[0].getsockname()[1]
+        c = Subscriber("localhost", port)
+        await c.open()
+
+        c.subscribe("foo")
+        await asyncio.sleep(0.05)
+        assert "foo" in relay.upstream.subscriptions
+        assert await c.get("foo") == ["1"]
+
+        # Block gets are refused rather than breaking the shared
+        # upstream connection.
+        assert isinstance(await c._request("get bar 4", 1.0), RuntimeError)
+        assert relay.upstream.running
+
+        # A request without a msgid is done, just not answered.
+        reader, writer = await asyncio.open_connection("localhost", port)
+        writer.write(b"set bar 2\n")
+        await writer.drain()
+        while not sets:
+            await asyncio.sleep(0.01)
+        assert sets == [["bar", "2"]]
+        writer.close()
+
+        await c.close()
+        await relay.close()
+
+
+@pytest.mark.asyncio
+async def test_unix_socket(tmp_path):
+    path = tmp_path / "relay.sock"
+    relay = Relay("localhost", 6868, listen_host=f"unix:{path}")
+    await relay.start()
+
+    c = Subscriber(f"unix:{path}")
+    assert await c.open()
+    assert await c.get("bar") == ["baz"]
+    await c.close()
+    await relay.close()
+
+    # TCP connections get TCP_NODELAY unless asked not to.
+    c = Subscriber(socket_options=dict(rcvbuf=1 << 16, keepalive=(10, 5, 3)))
+    await c.open()
+    sock = c.writer.get_extra_info("socket")
+    assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+    await c.close()
+    c = Subscriber(socket_options=dict(nodelay=False))
+    await c.open()
+    assert not c.writer.get_extra_info("socket").getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    await c.close()
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from saomsg.client import Subscriber
+from saomsg.server import MSGServer, check_host, match_host
+
+
+async def start_server(**kwargs):
+    server = MSGServer("PYSRV", host="localhost", port=0, **kwargs)
+    server.publish("foo", "1.0", "The foo value")
+    server.publish("bar", "baz")
+
+    @server.register("multiply", comment="foo = x * y")
+    async def multiply(x, y):
+        server.set("foo", int(x) * int(y))
+
+    @server.register("fail")
+    def fail():
+        raise ValueError("no good")
+
+    await server.start()
+    return server, server.server.sockets[0].getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_server():
+    server, port = await start_server()
+    c = Subscriber("localhost", port)
+    assert await c.open()
+    assert c.server_info["name"] == "PYSRV"
+    assert list(c.server_info["published"]) == ["foo", "bar"]
+    assert c.catalog.comment("multiply") == "foo = x * y"
+
+    assert await c.get("bar") == ["baz"]
+    assert isinstance(await c.get("nope"), RuntimeError)
+    await c.set("bar", "a b")
+    assert server.get("bar") == "a b"
+    assert await c.run("multiply", 3, 7) == []
+    assert server.get("foo") == "21"
+    with pytest.raises(RuntimeError, match="no good"):
+        await c.run("fail")
+    assert isinstance(await c._request("bogus"), RuntimeError)
+
+    await c.close()
+    await asyncio.sleep(0.01)
+    assert server.stats() == dict(clients=0, subscriptions=0)
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_server_posts():
+    server, port = await start_server()
+    every, throttled, setter = (Subscriber("localhost", port) for _ in range(3))
+    for c in (every, throttled, setter):
+        await c.open()
+
+    queues = {c: asyncio.Queue() for c in (every, throttled, setter)}
+    assert await every.subscribe("foo", queues[every].put_nowait, min_interval=0) == ["1.0"]
+    await throttled.subscribe("foo", queues[throttled].put_nowait, min_interval=0.2)
+    await setter.subscribe("foo", queues[setter].put_nowait, min_interval=0)
+    assert server.stats() == dict(clients=3, subscriptions=3)
+    for queue in queues.values():
+        assert await asyncio.wait_for(queue.get(), 1.0) == ["1.0"]
+
+    # update 0 is posted every set, a positive update only changes,
+    # throttled, and the setter is not posted its own set.
+    for value in ("2", "2", "3"):
+        server.set("foo", value)
+    await setter.set("foo", "4")
+    await asyncio.sleep(0.1)
+    assert [queues[every].get_nowait() for _ in range(queues[every].qsize())] == [["2"], ["2"], ["3"], ["4"]]
+    assert [queues[setter].get_nowait() for _ in range(queues[setter].qsize())] == [["2"], ["2"], ["3"]]
+    assert queues[throttled].empty()
+    assert await asyncio.wait_for(queues[throttled].get(), 1.0) == ["4"]
+    await asyncio.sleep(0.3)
+    assert queues[throttled].empty()
+
+    for c in (every, throttled, setter):
+        await c.close()
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_server_hosts():
+    assert match_host("mmt.mmto.org", "mmto.org")
+    assert match_host("MMT.mmto.org", "m*.mmto.org")
+    assert not match_host("mmto.org", "mmt.mmto.org")
+    assert not match_host("evil.org", "mmto.org")
+    assert check_host(["hacks.mmto.org"], allow=["hacks.mmto.org"], deny=["*"])
+    assert not check_host(["10.0.0.1", "other.org"], allow=["hacks.mmto.org"], deny=["*"])
+    assert check_host(["other.org"])
+
+    server, port = await start_server(deny=["*"])
+    c = Subscriber("localhost", port)
+    with pytest.raises(ConnectionError):
+        await c.open()
+    await c.close()
+    await server.close()
+
+    server, port = await start_server(allow=["127.0.0.1"], deny=["*"])
+    c = Subscriber("localhost", port)
+    assert await c.open()
+    await c.close()
+    await server.close()
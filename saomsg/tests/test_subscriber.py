@@ -1,6 +1,13 @@
+import asyncio
+import gc
+import socket
+import threading
+import time
+
 import pytest
 
-from saomsg.client import Subscriber
+from saomsg.client import PostedValues, SET, Subscriber, Subscription, connect_all
+from saomsg.rtt import AdaptiveTimeouts
 
 
 @pytest.mark.asyncio
@@ -11,6 +18,658 @@ async def test_client():
     await c.close()
 
 
+class FakeWriter:
+    """Stands in for the StreamWriter and records what is written."""
+
+    def __init__(self):
+        self.written = []
+        self.transport = self
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return False
+
+
+def offline_subscriber(*chunks, **kwargs):
+    """A Subscriber that reads chunks instead of a socket."""
+    c = Subscriber(**kwargs)
+    c.writer = FakeWriter()
+    c.server_info = dict(name="TESTSRV", published=[], registered=[], subscribed=PostedValues())
+    c.subscriptions = {}
+    c.executors = {}
+    c.running = True
+    c.reader = asyncio.StreamReader()
+    for chunk in chunks:
+        c.reader.feed_data(chunk)
+    return c
+
+
+class Writes(list):
+    """The chunks a client has written, in order."""
+
+    def lines(self):
+        return b"".join(self).splitlines()
+
+
+def record_writes(c):
+    """Record everything c writes to its connection while still sending it."""
+    writes = Writes()
+    write = c.writer.write
+
+    def recording_write(data):
+        writes.append(data)
+        write(data)
+
+    c.writer.write = recording_write
+    return writes
+
+
+class StandIn:
+    """
+    A stand-in MSG server on a free port, used as an async
+    context manager. lst is answered with the published params
+    and registered commands given. Any other request is passed
+    to answer(msgid, verb, args), which returns the text to send
+    back or None to leave it unanswered, as a hung server would.
+    By default nothing else is answered.
+    """
+
+    def __init__(self, published=(), registered=(), answer=None):
+        self.listing = "server\tSTANDIN\tx\n"
+        self.listing += "".join(f"published\t{param}\tx\n" for param in published)
+        self.listing += "".join(f"registered\t{command}\tx\n" for command in registered)
+        self.answer = answer or (lambda msgid, verb, args: None)
+        self.conns = []
+        self.lsts = []
+        self.handlers = []
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, "localhost", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        for writer in self.conns:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.gather(*self.handlers)
+
+    async def _handle(self, reader, writer):
+        self.conns.append(writer)
+        self.handlers.append(asyncio.current_task())
+        while line := await reader.readline():
+            msgid, verb, *args = line.decode().split()
+            if verb == "lst":
+                self.lsts.append(msgid)
+                reply = f"{msgid} ack\n{self.listing}----LIST----\n"
+            else:
+                reply = self.answer(msgid, verb, args)
+            if reply:
+                writer.write(reply.encode())
+        writer.close()
+
+
+@pytest.mark.asyncio
+async def test_chunked_read():
+    # Lines split across reads must be reassembled and
+    # the loop must stop when the server hangs up.
+    c = offline_subscriber(b"0 set foo 1", b"0.0\n0 set bar baz\n\n0 set ba", b"zz there once\n")
+    c.reader.feed_eof()
+    for param in ("foo", "bar", "bazz"):
+        c.subscriptions[param] = Subscription(param)
+
+    c._start_reader()
+    await asyncio.wait_for(c.mainloop(), 1.0)
+    assert not c.running
+    # Nobody has looked at the posts yet, so they are still bytes.
+    post = c.server_info["subscribed"].data["bazz"]
+    assert type(post) is SET and post._text is None and post._value is None
+    assert c.server_info["subscribed"] == dict(foo="10.0", bar="baz", bazz="there once")
+    assert c.cached("bazz")[0] == ["there", "once"]
+
+
+@pytest.mark.asyncio
+async def test_conflate():
+    c = offline_subscriber()
+    seen = []
+
+    async def slow(value):
+        seen.append(value)
+        await asyncio.sleep(0.05)
+
+    c.subscriptions["foo"] = Subscription("foo", slow, conflate=True)
+    c._start_reader()
+
+    c.reader.feed_data(b"".join(b"0 set foo %d\n" % i for i in range(10)))
+    await asyncio.sleep(0.01)
+    c.reader.feed_data(b"0 set foo 10\n0 set foo 11\n")
+    await asyncio.sleep(0.2)
+
+    # The first value is delivered straight away and the newest
+    # one when that call is done, everything in between is dropped.
+    assert seen == ["0", "11"]
+    assert c.subscriptions["foo"].dropped == 10
+
+    c.reader.feed_eof()
+    await asyncio.wait_for(c.mainloop(), 1.0)
+
+
+@pytest.mark.asyncio
+async def test_task_registry():
+    c = offline_subscriber(max_tasks=3, max_tasks_per_param=2)
+    running = []
+
+    async def slow(value):
+        running.append(len(c.tasks))
+        await asyncio.sleep(0.02)
+        if value == "bad":
+            raise ValueError(value)
+
+    c.subscriptions["foo"] = Subscription("foo", slow)
+    c.subscriptions["bar"] = Subscription("bar", slow)
+    c._start_reader()
+    c.reader.feed_data(b"".join(b"0 set foo %d\n0 set bar bad\n" % i for i in range(5)))
+    await asyncio.sleep(0.2)
+
+    # Never more than 3 tasks at once, finished ones are gone
+    # and the failures were recorded rather than lost.
+    assert max(running) <= 3
+    assert not c.tasks
+    stats = c.callback_stats()
+    assert stats["bar"]["errors"] == stats["bar"]["calls"] > 0
+    assert isinstance(stats["bar"]["last_error"], ValueError)
+    assert stats["foo"]["errors"] == 0 and stats["foo"]["max_time"] >= 0.02
+    assert stats["foo"]["calls"] == 5 and stats["foo"]["dropped"] == 0
+
+    c.reader.feed_eof()
+    await asyncio.wait_for(c.mainloop(), 1.0)
+
+
+@pytest.mark.asyncio
+async def test_backlog():
+    # Values past the cap of a callback that did not ask for
+    # conflation wait their turn, and a full backlog stops the
+    # read loop rather than dropping anything.
+    c = offline_subscriber(max_tasks_per_param=2)
+    seen = []
+
+    async def slow(value):
+        await asyncio.sleep(0.01)
+        seen.append(value)
+
+    c.subscriptions["foo"] = Subscription("foo", slow, max_pending=5)
+    c._start_reader()
+    c.reader.feed_data(b"".join(b"0 set foo %d\n" % i for i in range(30)))
+    await asyncio.sleep(0.002)
+    c.reader.feed_data(b"0 set foo 30\n")
+    await asyncio.sleep(0.002)
+    assert c._backlogged == {c.subscriptions["foo"]} and len(c.subscriptions["foo"].backlog) == 28
+    await asyncio.sleep(0.3)
+
+    assert sorted(seen, key=int) == [str(i) for i in range(31)]
+    stats = c.callback_stats()["foo"]
+    assert stats["calls"] == 31 and stats["dropped"] == 0 and stats["queued"] == 0
+
+    c.reader.feed_eof()
+    await asyncio.wait_for(c.mainloop(), 1.0)
+
+
+@pytest.mark.asyncio
+async def test_executor_callback():
+    c = offline_subscriber()
+    c.server_info["published"] = ["foo", "bar"]
+    c._start_reader()
+
+    def crunch(value):
+        time.sleep(0.01)
+        return int(value[0]) ** 2, threading.current_thread() is threading.main_thread()
+
+    results = []
+    c.subscribe("foo", crunch, executor="thread", max_pending=2, on_result=results.append)
+    c.reader.feed_data(b"".join(b"0 set foo %d\n" % i for i in range(10)))
+
+    for _ in range(100):
+        await asyncio.sleep(0.02)
+        if len(results) == 10:
+            break
+    # Every value made it through, in order and off the loop's thread.
+    assert results == [(i * i, False) for i in range(10)]
+
+    with pytest.raises(ValueError):
+        c.subscribe("bar", test_executor_callback, executor="thread")
+
+    # The worker feeding the executor is not a callback task and
+    # goes away with the subscription.
+    worker = c.subscriptions["foo"].worker
+    assert worker not in c.tasks
+    c.unsubscribe("foo")
+    await asyncio.sleep(0)
+    assert worker.cancelled()
+
+    await c.stop()
+
+    # close() on its own tears the workers and pools down too.
+    c = Subscriber()
+    await c.open()
+    c.subscribe("foo", crunch, executor="thread")
+    worker = c.subscriptions["foo"].worker
+    pool = c.executors["thread"]
+    await c.close()
+    await asyncio.sleep(0)
+    assert worker.cancelled() and not c.executors and pool._shutdown
+
+
+@pytest.mark.asyncio
+async def test_reply_table():
+    c = offline_subscriber()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await c.get("foo", timeout=0.01)
+    task = asyncio.create_task(c.get("foo"))
+    await asyncio.sleep(0.01)
+    assert c.reply_stats()["pending"] == 1
+    assert c.reply_stats()["oldest_age"] > 0
+    task.cancel()
+    await asyncio.sleep(0)
+    # Neither request is left behind in the reply table.
+    assert c.reply_stats() == dict(pending=0, oldest_age=0.0, timeouts=1, cancelled=1)
+
+    # msgids wrap around without reusing 0 or one in flight.
+    c.nextid = c.MAXID - 1
+    c.outstanding_replies[1] = asyncio.get_running_loop().create_future()
+    assert [c.getid() for _ in range(3)] == [c.MAXID - 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    c = Subscriber(single_flight=True, fresh_window=0.5)
+    await c.open()
+    writes = record_writes(c)
+
+    values = await asyncio.gather(*(c.get("bar") for _ in range(10)), c.get("bazz"))
+    assert values == [["baz"]] * 10 + [["there", "once", "was", "a", "man"]]
+    assert len(writes.lines()) == 2
+
+    # A fresh reply is reused, a stale one is not.
+    assert await c.get("bar") == ["baz"]
+    assert len(writes.lines()) == 2
+    c.fresh_window = 0
+    assert await c.get("bar") == ["baz"]
+    assert len(writes.lines()) == 3
+
+    await c.close()
+
+    # Against a hung server every caller gets its own timeout, and
+    # a get abandoned by all its callers doesn't leave an
+    # unretrieved exception behind.
+    errors = []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+    async with StandIn(published=["foo", "bar"]) as server:
+        c = Subscriber("localhost", server.port, single_flight=True)
+        await c.open()
+        first = asyncio.create_task(c.get("foo", timeout=5.0))
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        with pytest.raises(asyncio.TimeoutError):
+            await c.get("foo", timeout=0.05)
+        assert time.perf_counter() - start < 1.0
+        first.cancel()
+
+        lonely = asyncio.create_task(c.get("bar", timeout=0.05))
+        await asyncio.sleep(0)
+        lonely.cancel()
+        await asyncio.sleep(0.1)
+        gc.collect()
+        assert not errors
+        await c.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_get():
+    c = Subscriber()
+    await c.open()
+    bars = asyncio.Queue()
+    c.subscribe("bar", bars.put_nowait)
+    await asyncio.wait_for(bars.get(), 1.0)
+
+    value, received = c.cached("bar")
+    assert value == ["baz"] and received <= time.monotonic()
+
+    writes = record_writes(c)
+
+    assert await c.get("bar", max_age=10) == ["baz"]
+    assert writes == []
+    await asyncio.sleep(0.01)
+    assert await c.get("bar", max_age=0.005) == ["baz"]
+    assert len(writes.lines()) == 1
+    # Not subscribed, so always from the server.
+    assert await c.get("bazz", max_age=10) == ["there", "once", "was", "a", "man"]
+    assert len(writes.lines()) == 2
+
+    await c.close()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_ack():
+    c = Subscriber()
+    await c.open()
+    bars = []
+    assert await asyncio.wait_for(c.subscribe("bar", bars.append), 1.0) == ["baz"]
+    assert bars == [["baz"]]
+    assert c.server_info["subscribed"]["bar"] == "baz"
+    assert c.cached("bar")[0] == ["baz"]
+
+    # The post that repeats the ack is not delivered again.
+    await asyncio.sleep(0.2)
+    assert bars == [["baz"]]
+    await c.close()
+
+    # A post that differs from the ack is delivered.
+    c = offline_subscriber()
+    c.server_info["published"].append("foo")
+    foos = []
+    ready = c.subscribe("foo", foos.append)
+    c.reader.feed_data(b"1 ack 1\n0 set foo 2\n0 set foo 2\n")
+    c.reader.feed_eof()
+    c._start_reader()
+    await asyncio.wait_for(c.mainloop(), 1.0)
+    assert ready.result() == ["1"]
+    assert foos == [["1"], ["2"], ["2"]]
+
+
+@pytest.mark.asyncio
+async def test_reconnect():
+    # A stand-in server that only answers gets from the second
+    # connection on, so a get is left in flight when we drop the
+    # first one.
+    subs = []
+
+    def answer(msgid, verb, args):
+        if verb == "sub":
+            subs.append(args[0])
+            return f"{msgid} ack 1\n0 set {args[0]} 1\n"
+        if verb == "get" and len(server.conns) > 1:
+            return f"{msgid} ack 1\n"
+
+    async with StandIn(published=["foo", "bar"], answer=answer) as server:
+        c = Subscriber("localhost", server.port, reconnect=True, retry=("get",))
+        await c.open()
+        foos = []
+        assert await c.subscribe("foo", foos.append) == ["1"]
+        getting = asyncio.create_task(c.get("foo"))
+        setting = asyncio.create_task(c.set("foo", "2"))
+        await asyncio.sleep(0.1)
+        server.conns[0].close()
+
+        # The get is retried, the set fails and the subscription
+        # is replayed without another lst.
+        assert await asyncio.wait_for(getting, 2.0) == ["1"]
+        with pytest.raises(ConnectionError):
+            await setting
+        while len(foos) < 2:
+            await asyncio.sleep(0.01)
+        assert foos == [["1"], ["1"]]
+        assert c.reconnects == 1 and len(server.lsts) == 1
+        assert c.reply_stats()["pending"] == 0
+
+        # A subscription made while reconnecting is sent once.
+        server.conns[-1].close()
+        while c.running:
+            await asyncio.sleep(0.001)
+        bars = []
+        ready = c.subscribe("bar", bars.append)
+        assert await asyncio.wait_for(ready, 2.0) == ["1"]
+        await asyncio.sleep(0.05)
+        assert subs.count("bar") == 1 and bars == [["1"]]
+
+        await c.stop()
+        await c.close()
+
+
+@pytest.mark.asyncio
+async def test_heartbeat():
+    c = Subscriber(heartbeat=0.05)
+    await c.open()
+    await asyncio.sleep(0.3)
+    stats = c.rtt_stats()
+    assert stats["samples"] >= 3 and stats["missed"] == 0
+    assert 0 < stats["min"] <= stats["srtt"] <= stats["max"] < 0.05
+    await c.close()
+
+    # A server that answers lst but nothing else is hung.
+    async with StandIn() as server:
+        c = Subscriber("localhost", server.port, heartbeat=0.05, heartbeat_misses=2)
+        await c.open()
+        await asyncio.wait_for(c.mainloop(), 1.0)
+        stats = c.rtt_stats()
+        assert not c.running and stats["hangs"] == 1 and stats["missed"] == 2 and stats["samples"] == 0
+        await c.close()
+
+
+@pytest.mark.asyncio
+async def test_adaptive_timeouts(tmp_path):
+    path = tmp_path / "timeouts.json"
+    c = Subscriber(timeouts=AdaptiveTimeouts(path))
+    assert c.timeouts.timeout("get bar") == AdaptiveTimeouts.INITIAL
+    await c.open()
+    for _ in range(5):
+        await c.get("bar")
+    await c.run("multiply", 3, 7)
+    stats = c.timeouts.stats()
+    assert stats["get bar"]["samples"] == 5 and stats["multiply"]["samples"] == 1
+    # Fast requests get the floor.
+    assert stats["get bar"]["timeout"] == AdaptiveTimeouts.FLOOR
+    await c.close()
+
+    # What was learned is there for the next session.
+    timeouts = AdaptiveTimeouts(path)
+    assert timeouts.stats() == stats
+
+    # A slow command gets time in proportion, doubled by a timeout.
+    timeouts.observe("filter1Wheel", 20.0)
+    assert timeouts.timeout("filter1Wheel") == 60.0
+    timeouts.expired("filter1Wheel")
+    assert timeouts.timeout("filter1Wheel") == 120.0
+    timeouts.observe("filter1Wheel", 20.0)
+    assert timeouts.timeout("filter1Wheel") < 60.0
+
+
+@pytest.mark.asyncio
+async def test_get_block():
+    c = offline_subscriber()
+    c.server_info["published"].append("foo")
+    foos = []
+    c.subscribe("foo", foos.append)
+    c._start_reader()
+    out = bytearray(12)
+    getting = asyncio.create_task(c.get_block("frame", 11, out))
+    await asyncio.sleep(0.01)
+    assert b"".join(c.writer.written) == b"1 sub foo\n2 get frame 11\n"
+
+    # The block holds newlines and follows its header mid chunk.
+    c.reader.feed_data(b"1 ack 1\n2 blk 11\nab\n")
+    c.reader.feed_data(b"cd 0 nak")
+    c.reader.feed_data(b"\n0 set foo 2\n")
+    assert await asyncio.wait_for(getting, 1.0) is out
+    assert out == b"ab\ncd 0 nak\0"
+    assert foos == [["1"], ["2"]]
+
+    # A block of the wrong size is skipped.
+    getting = asyncio.create_task(c.get_block("frame", 4))
+    await asyncio.sleep(0.01)
+    c.reader.feed_data(b"3 blk 2\nxy0 set foo 3\n")
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(getting, 1.0)
+    with pytest.raises(TypeError):
+        await c.get_block("frame", 4, b"read only")
+    while len(foos) < 3:
+        await asyncio.sleep(0.01)
+    assert foos[-1] == ["3"] and c.reply_stats()["pending"] == 0
+
+    # A block given up on before its header arrives is read and
+    # thrown away, not taken for lines.
+    with pytest.raises(asyncio.TimeoutError):
+        await c.get_block("frame", 12, timeout=0.01)
+    c.reader.feed_data(b"4 blk 12\n0 set foo 9\n0 set foo 4\n")
+    # And one given up on part way stops being written to out.
+    out = bytearray(4)
+    getting = asyncio.create_task(c.get_block("frame", 4, out, timeout=0.05))
+    await asyncio.sleep(0.01)
+    c.reader.feed_data(b"5 blk 4\nab")
+    with pytest.raises(asyncio.TimeoutError):
+        await getting
+    c.reader.feed_data(b"cd0 set foo 5\n")
+    while len(foos) < 5:
+        await asyncio.sleep(0.01)
+    assert foos[3:] == [["4"], ["5"]] and out == b"ab\0\0"
+    assert not c._blocks and c.reply_stats()["pending"] == 0
+    await c.stop()
+
+
+@pytest.mark.asyncio
+async def test_connect_all():
+    # A server that never answers lst and a port nobody listens on.
+    async def silent(reader, writer):
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(silent, "localhost", 0)
+    hung = ("localhost", server.sockets[0].getsockname()[1])
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        dead = sock.getsockname()
+
+    start = time.perf_counter()
+    reports = await connect_all(["localhost:6868", hung, dead], deadline=0.5, required=["localhost:6868", dead])
+    assert time.perf_counter() - start < 0.5
+    up = reports[("localhost", 6868)]
+    assert up.done and up.client.running and up.connect > 0 and up.lst > 0
+    assert isinstance(reports[dead].error, ConnectionRefusedError)
+    assert not reports[hung].done
+
+    await asyncio.sleep(0.6)
+    assert reports[hung].done and isinstance(reports[hung].error, asyncio.TimeoutError)
+    await up.client.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_get_set_many():
+    c = Subscriber()
+    await c.open()
+
+    values = await c.get_many(["bar", "bazz", "oof", "fizz"])
+    assert values["bar"] == ["baz"]
+    assert values["bazz"] == ["there", "once", "was", "a", "man"]
+    assert values["fizz"] == []
+    # A nak for one param must not spoil the others.
+    assert isinstance(values["oof"], RuntimeError)
+
+    replies = await c.set_many(dict(fizz="buzz", oof="nope"))
+    assert replies["fizz"] == []
+    assert isinstance(replies["oof"], RuntimeError)
+    assert (await c.get_many(["fizz"]))["fizz"] == ["buzz"]
+
+    await c.set("fizz", "")
+    await c.close()
+
+    # A reply that never comes times out on its own.
+    def answer(msgid, verb, args):
+        if args == ["foo"]:
+            return f"{msgid} ack 1\n"
+
+    async with StandIn(published=["foo"], answer=answer) as server:
+        c = Subscriber("localhost", server.port)
+        await c.open()
+        values = await c.get_many(["foo", "bar"], timeout=0.05)
+        assert values["foo"] == ["1"] and isinstance(values["bar"], asyncio.TimeoutError)
+        assert c.reply_stats()["pending"] == 0
+        await c.close()
+
+
+@pytest.mark.asyncio
+async def test_write_coalescing():
+    c = Subscriber()
+    await c.open()
+
+    writes = record_writes(c)
+    c.subscribe("foo")
+    c.subscribe("bar")
+    values = await asyncio.gather(*(c.get(p) for p in ["bar", "bazz"] * 10))
+    assert values == [["baz"], ["there", "once", "was", "a", "man"]] * 10
+    # The subscriptions went out together and so did all 20
+    # gets, which were issued in the next loop iteration.
+    assert [w.count(b"\n") for w in writes] == [2, 20]
+
+    c.unsubscribe("bar")
+    assert "bar" not in c.server_info["subscribed"]
+    await c.close()
+
+
+@pytest.mark.asyncio
+async def test_post_after_unsubscribe():
+    # A post already on its way when we unsubscribe must not make
+    # the param look subscribed again.
+    c = offline_subscriber()
+    c.server_info["published"] = ["foo"]
+    c._start_reader()
+    c.subscribe("foo")
+    c.unsubscribe("foo")
+    c.reader.feed_data(b"0 set foo 2\n")
+    await asyncio.sleep(0.01)
+    assert "foo" not in c.server_info["subscribed"] and c.cached("foo") is None
+
+    ready = c.subscribe("foo")
+    assert ready is c.subscriptions["foo"].ready
+    await asyncio.sleep(0.01)
+    assert b"".join(c.writer.written).count(b" sub foo") == 2
+
+    c.reader.feed_eof()
+    await asyncio.wait_for(c.mainloop(), 1.0)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_update():
+    c = Subscriber()
+    await c.open()
+
+    with pytest.raises(ValueError):
+        c.subscribe("foo", min_interval=1, period=1)
+    with pytest.raises(ValueError):
+        c.subscribe("foo", period=0.5)
+
+    writes = record_writes(c)
+
+    # min_interval=0 asks for every change.
+    foos = asyncio.Queue()
+    c.subscribe("foo", foos.put_nowait, min_interval=0)
+    bars = asyncio.Queue()
+    c.subscribe("bar", bars.put_nowait, period=1)
+    assert c.subscriptions["bar"].update == -1
+
+    await c.run("multiply", 3, 7)
+    while (await asyncio.wait_for(foos.get(), 1.0)) != ["21"]:
+        pass
+
+    # bar is posted once straight after the sub and then
+    # every second even though it never changes.
+    for _ in range(3):
+        assert (await asyncio.wait_for(bars.get(), 2.0)) == ["baz"]
+
+    assert b" sub foo 0\n" in writes[0] and b" sub bar -1\n" in writes[0]
+    await c.close()
+
+
 # @pytest.mark.asyncio
 # async def test_mainloop():
 #     c = Subscriber()
@@ -0,0 +1,82 @@
+"""
+Opening MSG connections. An endpoint is a host and port, or a
+host of the form "unix:/path/to/socket" for a Unix domain socket
+(the port is then ignored), e.g. for a relay on the same machine.
+
+TCP connections get TCP_NODELAY by default: MSG requests are
+short lines that are waited on, so Nagle's algorithm only adds
+latency. Socket buffer sizes and TCP keepalive can be set too.
+"""
+import asyncio
+import socket
+
+UNIX_PREFIX = "unix:"
+
+
+def unix_path(host):
+    """Return the socket path if host is a unix: endpoint, else None."""
+    if isinstance(host, str) and host.startswith(UNIX_PREFIX):
+        return host[len(UNIX_PREFIX):]
+    return None
+
+
+def set_options(sock, nodelay=True, rcvbuf=None, sndbuf=None, keepalive=None):
+    """
+    Apply socket options to sock. keepalive is True to turn TCP
+    keepalive on with the system settings, or (idle, interval,
+    count): probe after idle seconds of silence, every interval
+    seconds, and give up after count probes. Options that don't
+    apply to the socket's family, or the platform, are skipped.
+    """
+    if sock is None:
+        return
+    is_tcp = sock.family in (socket.AF_INET, socket.AF_INET6)
+
+    if rcvbuf is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if not is_tcp:
+        return
+
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(bool(nodelay)))
+    if keepalive:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if keepalive is not True:
+            idle, interval, count = keepalive
+            for name, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+                if hasattr(socket, name):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), int(value))
+
+
+async def open_connection(host, port, limit=None, **options):
+    """
+    Open a connection to host:port, or the unix: socket named by
+    host, with options (see set_options) and return (reader,
+    writer) as asyncio.open_connection does.
+    """
+    kwargs = {} if limit is None else dict(limit=limit)
+    path = unix_path(host)
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path, **kwargs)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, **kwargs)
+    set_options(writer.get_extra_info("socket"), **options)
+    return reader, writer
+
+
+async def start_server(client_connected_cb, host, port, **options):
+    """
+    Listen on host:port, or the unix: socket named by host, and
+    apply options (see set_options) to every accepted connection
+    before handing it to client_connected_cb.
+    """
+
+    async def connected(reader, writer):
+        set_options(writer.get_extra_info("socket"), **options)
+        await client_connected_cb(reader, writer)
+
+    path = unix_path(host)
+    if path is not None:
+        return await asyncio.start_unix_server(connected, path)
+    return await asyncio.start_server(connected, host, port)